@@ -21,6 +21,7 @@ class GearBot(AutoShardedBot):
     database_connection = None
     locked = True
     redis_pool = None
+    spam_engine = None
     aiosession = None
     being_cleaned = dict()
     metrics_reg = CollectorRegistry()
@@ -33,6 +34,7 @@ class GearBot(AutoShardedBot):
     missing_guilds = []
     initial_fill_complete = False
     loading_task = None
+    config_listener = None
 
     def __init__(self, *args, loop=None, **kwargs):
         super().__init__(*args, loop=loop, **kwargs)
@@ -77,4 +79,13 @@ class GearBot(AutoShardedBot):
     async def on_guild_update(self, before, after):
         await TheRealGearBot.on_guild_update(before, after)
 
+    async def on_member_update(self, before, after):
+        await TheRealGearBot.on_member_update(before, after)
+
+    async def on_guild_role_update(self, before, after):
+        await TheRealGearBot.on_guild_role_update(before, after)
+
+    async def on_guild_role_delete(self, role):
+        await TheRealGearBot.on_guild_role_delete(role)
+
     #### reloading
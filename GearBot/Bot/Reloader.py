@@ -2,7 +2,8 @@ from Bot import TheRealGearBot
 from Cogs import BaseCog
 from Util import Configuration, GearbotLogging, Emoji, Pages, Utils, Translator, Converters, Permissioncheckers, \
     VersionInfo, Confirmation, HelpGenerator, InfractionUtils, Archive, DocUtils, JumboGenerator, MessageUtils, Enums, \
-    Matchers, Questions, Selfroles, ReactionManager, server_info, DashConfig, Update, DashUtils, Actions, Features
+    Matchers, Questions, Selfroles, ReactionManager, server_info, DashConfig, Update, DashUtils, Actions, Features, \
+    SpamBucket, CensorMatcher, ConfigStore, Scheduler
 from Util.RaidHandling import RaidActions, RaidShield
 from database import DBUtils
 
@@ -38,5 +39,9 @@ components = [
     BaseCog,
     DashUtils,
     Actions,
-    Features
+    Features,
+    SpamBucket,
+    CensorMatcher,
+    ConfigStore,
+    Scheduler
 ]
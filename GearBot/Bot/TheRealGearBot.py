@@ -20,20 +20,30 @@ from discord.ext import commands
 
 from Bot import GearBot
 from Util import Configuration, GearbotLogging, Emoji, Pages, Utils, Translator, InfractionUtils, MessageUtils, \
-    server_info, DashConfig
+    server_info, DashConfig, SpamBucket, Permissioncheckers, Features
 from Util.Permissioncheckers import NotCachedException
 from Util.Utils import to_pretty_time
 from database import DatabaseConnector
 
 
+# prefix -> full prefix tuple, shared by all guilds using the same prefix
+PREFIXES = dict()
+
+
 def prefix_callable(bot, message):
-    user_id = bot.user.id
-    prefixes = [f'<@!{user_id}> ', f'<@{user_id}> '] #execute commands by mentioning
     if message.guild is None:
-        prefixes.append('!') #use default ! prefix in DMs
+        return get_prefixes(bot, '!') #use default ! prefix in DMs
     elif bot.STARTUP_COMPLETE:
-        prefixes.append(Configuration.get_var(message.guild.id, "GENERAL", "PREFIX"))
-    return prefixes
+        return get_prefixes(bot, Features.get_prefix(message.guild.id))
+    return get_prefixes(bot, None)
+
+
+def get_prefixes(bot, prefix):
+    if prefix not in PREFIXES:
+        user_id = bot.user.id
+        prefixes = (f'<@!{user_id}> ', f'<@{user_id}> ') #execute commands by mentioning
+        PREFIXES[prefix] = prefixes + (prefix,) if prefix is not None else prefixes
+    return PREFIXES[prefix]
 
 async def initialize(bot, startup=False):
     #lock event handling while we get ready
@@ -71,9 +81,13 @@ async def initialize(bot, startup=False):
                 GearbotLogging.error("==============Failed to connect to redis==============")
                 await GearbotLogging.bot_log(f"{Emoji.get_chat_emoji('NO')} Failed to connect to redis, caching unavailable")
             else:
+                await SpamBucket.initialize(bot.redis_pool)
                 GearbotLogging.info("Cluster {bot.cluster} redis connection established")
                 await GearbotLogging.bot_log(f"{Emoji.get_chat_emoji('YES')} Cluster {bot.cluster} redis connection established, let's go full speed!")
 
+        if bot.spam_engine is None:
+            bot.spam_engine = SpamBucket.FailoverEngine(bot)
+
         if bot.aiosession is None:
             bot.aiosession = aiohttp.ClientSession()
 
@@ -93,6 +107,7 @@ async def on_ready(bot):
     try:
         if not bot.STARTUP_COMPLETE:
             await initialize(bot, True)
+            await Configuration.preload([g.id for g in bot.guilds])
             #shutdown handler for clean exit on linux
             try:
                 for signame in ('SIGINT', 'SIGTERM'):
@@ -123,6 +138,7 @@ async def on_ready(bot):
             await GearbotLogging.bot_log(message=f"{a} All gears turning at full speed, {info.name} ready to go! {b}")
             await bot.change_presence(activity=Activity(type=3, name='the gears turn'))
         else:
+            await Configuration.preload([g.id for g in bot.guilds])
             await bot.change_presence(activity=Activity(type=3, name='the gears turn'))
 
         bot.missing_guilds = []
@@ -185,8 +201,11 @@ async def on_message(bot, message:Message):
         else:
             bot.bot_messages += 1
         return
-    ctx: commands.Context = await bot.get_context(message)
     bot.user_messages += 1
+    # most messages aren't commands, don't bother building a context for those
+    if not message.content.startswith(prefix_callable(bot, message)):
+        return
+    ctx: commands.Context = await bot.get_context(message)
     if ctx.valid and ctx.command is not None:
         bot.commandCount = bot.commandCount + 1
         if isinstance(ctx.channel, TextChannel) and not ctx.channel.permissions_for(ctx.channel.guild.me).send_messages:
@@ -224,7 +243,7 @@ async def on_guild_join(bot, guild: Guild):
         await guild.chunk(cache=True)
         bot.missing_guilds.remove(guild.id)
         GearbotLogging.info(f"A new guild came up: {guild.name} ({guild.id}).")
-        Configuration.load_config(guild.id)
+        await Configuration.load_config_async(guild.id)
         name = await Utils.clean(guild.name)
         await GearbotLogging.bot_log(f"{Emoji.get_chat_emoji('JOIN')} A new guild came up: {name} ({guild.id}).", embed=server_info.server_info_embed(guild))
 
@@ -246,6 +265,21 @@ async def on_guild_update(before, after):
             pass
         await after.leave()
 
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        Permissioncheckers.invalidate_member(after.guild.id, after.id)
+
+
+async def on_guild_role_update(before, after):
+    # permission changes on a role affect the level of everyone who has it
+    if before.permissions != after.permissions:
+        Permissioncheckers.invalidate_guild(after.guild.id)
+
+
+async def on_guild_role_delete(role):
+    Permissioncheckers.invalidate_guild(role.guild.id)
+
+
 class PostParseError(commands.BadArgument):
 
     def __init__(self, type, error):
@@ -6,7 +6,7 @@ import emoji
 from asyncio.base_futures import CancelledError
 
 import time
-from collections import deque
+from collections import deque, namedtuple
 from weakref import WeakValueDictionary
 
 from discord import Object, Forbidden, NotFound
@@ -41,6 +41,9 @@ class Violation:
         self.count = count
 
 
+PendingCheck = namedtuple("PendingCheck", "bucket op name friendly_key config")
+
+
 class ActionHolder:
 
     def __init__(self, count: int):
@@ -96,7 +99,7 @@ class AntiSpam(BaseCog):
         key = f"{guild_id}-{member_id}-{bucket_info['TYPE']}"
         c = bucket_info.get("SIZE").get("COUNT")
         p = bucket_info.get("SIZE").get("PERIOD")
-        return SpamBucket(self.bot.redis_pool, "{}:{}:{}".format(guild_id, rule_name, "{}"), c, p,
+        return SpamBucket(self.bot.spam_engine, "{}:{}:{}".format(guild_id, rule_name, "{}"), c, p,
                           self.get_extra_actions(key))
 
     @commands.Cog.listener()
@@ -116,32 +119,19 @@ class AntiSpam(BaseCog):
 
         # Use the discord's message timestamp to hopefully not trigger false positives
         msg_time = int(message.created_at.timestamp()) * 1000
-
-        async def check_bucket(check, friendly_text, amount, b):
-            # print(f"{check} - {amount}")
-            if amount == 0:
-                return
-
-            bucket = self.get_bucket(message.guild.id, check, b, message.author.id)
-            if bucket is not None and await bucket.check(message.author.id, msg_time, amount,
-                                                         f"{message.channel.id}-{message.id}"):
-                count = await bucket.count(message.author.id, msg_time, expire=False)
-                period = await bucket.size(message.author.id, msg_time, expire=False) / 1000
-                self.bot.loop.create_task(
-                    self.violate(Violation(check, message.guild, f"{friendly_text} ({count}/{period}s)", message.author,
-                                           message.channel, await bucket.get(message.author.id, msg_time, expire=False),
-                                           b, count)))
+        identifier = f"{message.channel.id}-{message.id}"
 
         counters = dict()
         buckets = Configuration.get_var(message.guild.id, "ANTI_SPAM", "BUCKETS", [])
 
         # so if someone does 20 levels of too many mentions for some stupid reason we don't end up running the same regex 20 times for nothing
         cache = dict()
+        checks = []
         for bucket in buckets:
             t = bucket["TYPE"]
             counter = counters.get(t, 0)
             if t == "duplicates":
-                await self.check_duplicates(message, counter, bucket)
+                checks.append(self.duplicates_check(message, counter, bucket, msg_time, identifier))
             else:
                 v = 0
                 if t in cache:
@@ -150,25 +140,35 @@ class AntiSpam(BaseCog):
                     v = self.generators[t](message)
                     cache[t] = v
                 if v is not 0:
-                    await check_bucket(f"{t}:{counter}", Translator.translate(f"spam_{t}", message), v, bucket)
+                    spam_bucket = self.get_bucket(message.guild.id, f"{t}:{counter}", bucket, message.author.id)
+                    checks.append(PendingCheck(spam_bucket, spam_bucket.op(message.author.id, msg_time, v, identifier),
+                                               f"{t}:{counter}", f"spam_{t}", bucket))
 
-    async def check_duplicates(self, message: Message, count: int, bucket):
+        await self.run_checks(message, checks)
+
+    async def run_checks(self, message: Message, checks):
+        # all buckets for this message go to the engine in one batch, so the cost doesn't grow with the bucket count
+        if len(checks) == 0:
+            return
+        states = await self.bot.spam_engine.run_many([c.op for c in checks])
+        violations = []
+        for check, state in zip(checks, states):
+            if check.bucket.is_triggered(state.count):
+                friendly = f"{Translator.translate(check.friendly_key, message)} ({state.count}/{state.span / 1000}s)"
+                violations.append(Violation(check.name, message.guild, friendly, message.author, message.channel,
+                                            state.members, check.config, state.count))
+        for v in violations:
+            self.bot.loop.create_task(self.violate(v))
+
+    def duplicates_check(self, message: Message, count: int, bucket, msg_time, identifier):
         rule = bucket["SIZE"]
         key = f"{message.guild.id}-{message.author.id}-{bucket['TYPE']}"
         full_content = message.content + "\n".join(str(a) for a in message.attachments)
-        spam_bucket = SpamBucket(self.bot.redis_pool,
+        spam_bucket = SpamBucket(self.bot.spam_engine,
                                  f"spam:duplicates{count}:{message.guild.id}:{message.author.id}:{'{}'}", rule["COUNT"],
                                  rule["PERIOD"], self.get_extra_actions(key))
-        t = int(message.created_at.timestamp()) * 1000
-        if await spam_bucket.check(full_content, t, 1, f"{message.channel.id}-{message.id}"):
-            count = await spam_bucket.count(full_content, t, expire=False)
-            period = await spam_bucket.size(message.author.id, t, expire=False) / 1000
-            st = Translator.translate('spam_max_duplicates', message)
-            self.bot.loop.create_task(self.violate(Violation("max_duplicates", message.guild,
-                                                             f"{st} ({count}/{period}s)",
-                                                             message.author, message.channel,
-                                                             await spam_bucket.get(full_content, t, expire=False),
-                                                             bucket, count)))
+        return PendingCheck(spam_bucket, spam_bucket.op(full_content, msg_time, 1, identifier), "max_duplicates",
+                            "spam_max_duplicates", bucket)
 
     async def violate(self, v: Violation):
         # deterining current punishment
@@ -248,6 +248,7 @@ class AntiSpam(BaseCog):
             i.end += duration
             i.reason += f'+ {reason}'
             await i.save()
+            InfractionUtils.schedule_expiry(i)
             GearbotLogging.log_key(v.guild.id, 'mute_duration_extended_log',
                                    user=Utils.clean_user(v.member),
                                    user_id=v.member.id,
@@ -255,7 +256,7 @@ class AntiSpam(BaseCog):
                                    moderator_id=v.guild.me.id,
                                    duration=Utils.to_pretty_time(duration, v.guild.id),
                                    reason=reason, inf_id=i.id, end=i.end)
-            InfractionUtils.clear_cache(v.guild.id)
+            InfractionUtils.clear_cache(v.guild.id, i)
 
     async def kick_punishment(self, v: Violation):
         reason = self.assemble_reason(v)
@@ -312,21 +313,14 @@ class AntiSpam(BaseCog):
                 if not cfg.get("ENABLED", False) or message.id in self.censor_processed:
                     continue
                 buckets = Configuration.get_var(message.guild.id, "ANTI_SPAM", "BUCKETS", [])
-                count = 0
+                msg_time = int(message.created_at.timestamp()) * 1000
+                checks = []
                 for b in buckets:
-                    t = b["TYPE"]
-                    if t == "censored":
-                        msg_time = int(message.created_at.timestamp()) * 1000
-                        bucket = self.get_bucket(message.guild.id, f"censored:{count}", b, message.author.id)
-                        if bucket is not None and await bucket.check(message.author.id, msg_time, 1, f"{message.channel.id}-{message.id}"):
-                            count = await bucket.count(message.author.id, msg_time, expire=False)
-                            period = await bucket.size(message.author.id, msg_time, expire=False) / 1000
-                            self.bot.loop.create_task(
-                                self.violate(Violation("max_censored", message.guild, f"{Translator.translate('spam_max_censored', message)} ({count}/{period}s)",
-                                                       message.author,
-                                                       message.channel,
-                                                       await bucket.get(message.author.id, msg_time, expire=False),
-                                                       b, count)))
+                    if b["TYPE"] == "censored":
+                        bucket = self.get_bucket(message.guild.id, "censored:0", b, message.author.id)
+                        checks.append(PendingCheck(bucket, bucket.op(message.author.id, msg_time, 1, f"{message.channel.id}-{message.id}"),
+                                                   "max_censored", "spam_max_censored", b))
+                await self.run_checks(message, checks)
 
             except CancelledError:
                 pass
@@ -1,4 +1,7 @@
+import asyncio
 import re
+import time
+from collections import namedtuple, OrderedDict
 from urllib import parse
 from urllib.parse import urlparse
 
@@ -8,15 +11,23 @@ from discord import DMChannel
 from discord.ext import commands
 
 from Cogs.BaseCog import BaseCog
-from Util import Configuration, GearbotLogging, Permissioncheckers, Utils, MessageUtils
+from Util import Configuration, GearbotLogging, Permissioncheckers, Utils, MessageUtils, CensorMatcher
 from Util.Matchers import INVITE_MATCHER, URL_MATCHER
 
 EMOJI_REGEX = re.compile('([^<]*)<a?:(?:[^:]+):([0-9]+)>')
+
+# guild_id is None for invalid invites and 0 for group dm invites
+InviteInfo = namedtuple("InviteInfo", "guild_id name")
+INVITE_TTL = 30 * 60
+INVITE_NEGATIVE_TTL = 5 * 60
+
 class Censor(BaseCog):
 
     def __init__(self, bot):
         super().__init__(bot)
-        self.regexes = dict()
+        self.pending_invites = dict()
+        # only used when redis isn't available, otherwise all clusters share the cache in redis
+        self.invite_cache = OrderedDict()
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -53,53 +64,45 @@ class Censor(BaseCog):
     async def check_message(self, member, content, channel, message_id):
         if Permissioncheckers.get_user_lvl(member.guild, member) >= 2:
             return
-        censorlist = Configuration.get_var(member.guild.id, "CENSORING", "TOKEN_CENSORLIST")
-        word_censorlist = Configuration.get_var(member.guild.id, "CENSORING", "WORD_CENSORLIST")
         guilds = Configuration.get_var(member.guild.id, "CENSORING", "ALLOWED_INVITE_LIST")
         domain_list = Configuration.get_var(member.guild.id, "CENSORING", "DOMAIN_LIST")
         domains_allowed = Configuration.get_var(member.guild.id, "CENSORING", "DOMAIN_LIST_ALLOWED")
-        full_message_list = Configuration.get_var(member.guild.id, "CENSORING", "FULL_MESSAGE_LIST")
         censor_emoji_message = Configuration.get_var(member.guild.id, "CENSORING", "CENSOR_EMOJI_ONLY_MESSAGES")
         content = content.replace('\\', '')
         decoded_content = parse.unquote(content)
 
         if len(guilds) is not 0:
             codes = INVITE_MATCHER.findall(decoded_content)
-            for code in codes:
-                try:
-                    invite: discord.Invite = await self.bot.fetch_invite(code)
-                except discord.NotFound:
+            for code in dict.fromkeys(codes):
+                invite = await self.resolve_invite(code)
+                if invite.guild_id is None:
                     await self.censor_invite(member, message_id, channel, code, "INVALID INVITE", content)
                     return
-                if invite.guild is None:
+                if invite.guild_id == 0:
                     await self.censor_invite(member, message_id, channel, code, "DM group", content)
                     return
                 else:
-                    if invite.guild is None or (not invite.guild.id in guilds and invite.guild.id != member.guild.id):
-                        await self.censor_invite(member, message_id, channel, code, invite.guild.name, content)
+                    if not invite.guild_id in guilds and invite.guild_id != member.guild.id:
+                        await self.censor_invite(member, message_id, channel, code, invite.name, content)
                         return
 
         content = content.lower()
 
-        if content in full_message_list:
+        matcher = CensorMatcher.get_matcher(member.guild.id)
+
+        if matcher.is_full_message(content):
             await self.censor_message(message_id, content, channel, member, "", "_content")
             return
 
-        for bad in (w.lower() for w in censorlist):
-            if bad in content:
-                await self.censor_message(message_id, content, channel, member, bad)
-                return
+        bad = matcher.find_token(content)
+        if bad is not None:
+            await self.censor_message(message_id, content, channel, member, bad)
+            return
 
-        if len(word_censorlist) > 0:
-            if channel.guild.id not in self.regexes:
-                regex = re.compile(r"\b(" + '|'.join(re.escape(word) for word in word_censorlist) + r")\b", re.IGNORECASE)
-                self.regexes[channel.guild.id] = regex
-            else:
-                regex = self.regexes[channel.guild.id]
-            match = regex.findall(content)
-            if len(match):
-                await self.censor_message(message_id, content, channel, member, match[0], "_word")
-                return
+        bad = matcher.find_word(content)
+        if bad is not None:
+            await self.censor_message(message_id, content, channel, member, bad, "_word")
+            return
 
         if len(domain_list) > 0:
             link_list = URL_MATCHER.findall(content)
@@ -120,6 +123,59 @@ class Censor(BaseCog):
 
 
 
+    async def resolve_invite(self, code):
+        metrics = self.bot.metrics.invite_cache_lookups
+        info = await self.get_cached_invite(code)
+        if info is not None:
+            metrics.labels(result="negative_hit" if info.guild_id is None else "hit").inc()
+            return info
+        # someone else is already looking this one up, piggyback on that instead of firing another request
+        if code in self.pending_invites:
+            metrics.labels(result="coalesced").inc()
+            return await asyncio.shield(self.pending_invites[code])
+        metrics.labels(result="miss").inc()
+        task = self.bot.loop.create_task(self.fetch_invite(code))
+        self.pending_invites[code] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self.pending_invites.get(code) is task:
+                del self.pending_invites[code]
+
+    async def fetch_invite(self, code):
+        try:
+            invite: discord.Invite = await self.bot.fetch_invite(code)
+        except discord.NotFound:
+            info = InviteInfo(None, None)
+        else:
+            info = InviteInfo(0, None) if invite.guild is None else InviteInfo(invite.guild.id, invite.guild.name)
+        await self.cache_invite(code, info)
+        return info
+
+    async def get_cached_invite(self, code):
+        if self.bot.redis_pool is None:
+            entry = self.invite_cache.get(code)
+            if entry is None or entry[0] < time.time():
+                return None
+            return entry[1]
+        parts = await self.bot.redis_pool.hgetall(f"invites:{code}")
+        if len(parts) == 0:
+            return None
+        return InviteInfo(int(parts["guild_id"]) if parts["guild_id"] != "" else None, parts["name"])
+
+    async def cache_invite(self, code, info):
+        ttl = INVITE_TTL if info.guild_id is not None else INVITE_NEGATIVE_TTL
+        if self.bot.redis_pool is None:
+            if len(self.invite_cache) >= 1000:
+                self.invite_cache.popitem(last=False)
+            self.invite_cache[code] = (time.time() + ttl, info)
+            return
+        pipe = self.bot.redis_pool.pipeline()
+        pipe.hmset_dict(f"invites:{code}", guild_id="" if info.guild_id is None else info.guild_id,
+                        name="" if info.name is None else info.name)
+        pipe.expire(f"invites:{code}", ttl)
+        await pipe.execute()
+
     async def censor_message(self, message_id, content, channel, member, bad, key=""):
         if channel.permissions_for(channel.guild.me).manage_messages:
             try:
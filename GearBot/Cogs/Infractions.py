@@ -1,4 +1,5 @@
 import asyncio
+import copy
 import re
 import typing
 from datetime import datetime
@@ -139,11 +140,12 @@ class Infractions(BaseCog):
     @inf.command()
     async def update(self, ctx: commands.Context, infraction: ServerInfraction, *, reason: Reason):
         """inf_update_help"""
+        old = copy.copy(infraction)
         infraction.mod_id = ctx.author.id
         infraction.reason = reason
         await infraction.save()
         await MessageUtils.send_to(ctx, 'YES', 'inf_updated', id=infraction.id)
-        InfractionUtils.clear_cache(ctx.guild.id)
+        InfractionUtils.clear_cache(ctx.guild.id, old, infraction)
         user = await Utils.get_user(infraction.user_id)
         GearbotLogging.log_key(ctx.guild.id, "inf_update_log", inf=infraction.id, user=Utils.clean_user(user), userid=user.id, mod=Utils.clean_user(ctx.author), modid=ctx.author.id, reason=reason)
 
@@ -160,7 +162,7 @@ class Infractions(BaseCog):
             GearbotLogging.log_key(ctx.guild.id, 'inf_delete_log', id=infraction.id, target=Utils.clean_user(target),
                                    target_id=target.id, mod=Utils.clean_user(mod), mod_id=mod.id if mod is not None else 0, reason=reason,
                                    user=Utils.clean_user(ctx.author), user_id=ctx.author.id)
-            InfractionUtils.clear_cache(ctx.guild.id)
+            InfractionUtils.clear_cache(ctx.guild.id, infraction)
 
         await Confirmation.confirm(ctx,
                                    text=f"{Emoji.get_chat_emoji('WARNING')} {Translator.translate('inf_delete_confirmation', ctx.guild.id, id=infraction.id, user=Utils.clean_user(target), user_id=target.id, reason=reason)}",
@@ -169,10 +171,11 @@ class Infractions(BaseCog):
     @inf.command('claim')
     async def claim(self, ctx, infraction: ServerInfraction):
         """inf_claim_help"""
+        old = copy.copy(infraction)
         infraction.mod_id = ctx.author.id
         await infraction.save()
         await MessageUtils.send_to(ctx, 'YES', 'inf_claimed', inf_id=infraction.id)
-        InfractionUtils.clear_cache(ctx.guild.id)
+        InfractionUtils.clear_cache(ctx.guild.id, old, infraction)
 
     IMAGE_MATCHER = re.compile(
         r'((?:https?://)[a-z0-9]+(?:[-.][a-z0-9]+)*\.[a-z]{2,5}(?::[0-9]{1,5})?(?:/[^ \n<>]*)\.(?:png|apng|jpg|gif))',
@@ -405,11 +405,7 @@ class ModLog(BaseCog):
                 for mid in event.message_ids:
                     self.bot.being_cleaned[event.channel_id].add(mid)
                 return
-            message_list = dict()
-            for mid in event.message_ids:
-                message = await MessageUtils.get_message_data(self.bot, mid)
-                if message is not None:
-                    message_list[mid] = message
+            message_list = await MessageUtils.get_messages_bulk(self.bot, event.message_ids)
             if len(message_list) > 0:
                 await Archive.archive_purge(self.bot, event.guild_id,
                                             collections.OrderedDict(sorted(message_list.items())))
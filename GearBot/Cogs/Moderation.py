@@ -18,9 +18,14 @@ from Util.Actions import ActionFailed
 from Util.Converters import BannedMember, UserID, Reason, Duration, DiscordUser, PotentialID, RoleMode, Guild, \
     RangedInt, Message, RangedIntBan, VerificationLevel, Nickname
 from Util.Permissioncheckers import bot_has_guild_permission
+from Util.Scheduler import Scheduler
 from database.DatabaseConnector import LoggedMessage, Infraction
 
 
+# how often to check the database for timed infractions the scheduler doesn't know about yet
+SWEEP_INTERVAL = 300
+
+
 class Moderation(BaseCog):
 
     def __init__(self, bot):
@@ -28,12 +33,18 @@ class Moderation(BaseCog):
 
         self.running = True
         self.handling = set()
+        self.scheduler = Scheduler("timed moderation actions", self.lift_expired)
+        self.scheduler.start()
+        InfractionUtils.scheduler = self.scheduler
         self.bot.loop.create_task(self.timed_actions())
         Pages.register("roles", self.roles_init, self.roles_update)
         Pages.register("mass_failures", self._mass_failures_init, self._mass_failures_update)
 
     def cog_unload(self):
         self.running = False
+        self.scheduler.stop()
+        if InfractionUtils.scheduler is self.scheduler:
+            InfractionUtils.scheduler = None
         Pages.unregister("roles")
 
     async def roles_init(self, ctx, **kwargs):
@@ -717,6 +728,7 @@ class Moderation(BaseCog):
                                 async def extend():
                                     infraction.end += duration_seconds
                                     await infraction.save()
+                                    InfractionUtils.schedule_expiry(infraction)
                                     await MessageUtils.send_to(ctx, 'YES', 'mute_duration_extended', duration=d, end=infraction.end)
                                     GearbotLogging.log_key(ctx.guild.id, 'mute_duration_extended_log', user=Utils.clean_user(target),
                                                            user_id=target.id,
@@ -737,6 +749,7 @@ class Moderation(BaseCog):
                                 async def until():
                                     infraction.end = time.time() + duration_seconds
                                     await infraction.save()
+                                    InfractionUtils.schedule_expiry(infraction)
                                     await MessageUtils.send_to(ctx, 'YES', 'mute_duration_added', duration=d)
                                     GearbotLogging.log_key(ctx.guild.id, 'mute_duration_added_log',
                                                            user=Utils.clean_user(target),
@@ -758,6 +771,7 @@ class Moderation(BaseCog):
                                 async def overwrite():
                                     infraction.end = infraction.start + duration_seconds
                                     await infraction.save()
+                                    InfractionUtils.schedule_expiry(infraction)
                                     await MessageUtils.send_to(ctx, 'YES', 'mute_duration_overwritten', duration=d, end=infraction.end)
                                     GearbotLogging.log_key(ctx.guild.id, 'mute_duration_overwritten_log',
                                                            user=Utils.clean_user(target),
@@ -1143,29 +1157,40 @@ class Moderation(BaseCog):
 
     async def timed_actions(self):
         GearbotLogging.info("Started timed moderation action background task")
+        # new infractions get scheduled right away, this only picks up what came in some other way
+        # (restarts, other clusters, manual database edits)
         while self.running:
-            # actions to handle and the function handling it
-            types = {
-                "Mute": self._lift_mute,
-                "Tempban": self._lift_tempban
-            }
-            now = time.time()
-            limit = time.time() + 30
-            for name, action in types.items():
-
-                for infraction in await Infraction.filter(type = name, active = True, end__lt=limit):
-                    if infraction.id not in self.handling and ((infraction.guild_id >> 22) % self.bot.total_shards) in self.bot.shard_ids:
-                        self.handling.add(infraction.id)
-                        self.bot.loop.create_task(
-                            self.run_after(infraction.end - now, action(infraction)))
-            await asyncio.sleep(10)
+            try:
+                expiring = await InfractionUtils.get_expiring(time.time() + SWEEP_INTERVAL * 2, self.bot.shard_ids, self.bot.total_shards)
+            except Exception as ex:
+                # database might not be (re)connected yet after a hot reload, try again soon instead of waiting a full interval
+                GearbotLogging.exception("Failed to fetch expiring infractions", ex)
+                await asyncio.sleep(10)
+                continue
+            for row in expiring:
+                if row["id"] not in self.handling:
+                    self.scheduler.schedule(row["id"], row["end"])
+            await asyncio.sleep(SWEEP_INTERVAL)
         GearbotLogging.info("Timed moderation actions background task terminated")
 
-    async def run_after(self, delay, action):
-        if delay > 0:
-            await asyncio.sleep(delay)
-        if self.running:  # cog got terminated, new cog is now in charge of making sure this gets handled
-            await action
+    async def lift_expired(self, infraction_id):
+        if infraction_id in self.handling:
+            return
+        self.handling.add(infraction_id)
+        try:
+            # get a fresh copy, it might have been lifted or changed since it was scheduled
+            infraction = await Infraction.get_or_none(id=infraction_id)
+            if infraction is None or not infraction.active or infraction.end is None:
+                return
+            if infraction.end > time.time():
+                self.scheduler.schedule(infraction.id, infraction.end)
+                return
+            if infraction.type == "Mute":
+                await self._lift_mute(infraction)
+            elif infraction.type == "Tempban":
+                await self._lift_tempban(infraction)
+        finally:
+            self.handling.discard(infraction_id)
 
     async def _lift_mute(self, infraction: Infraction):
         # check if we're even still in the guild
@@ -1246,7 +1271,6 @@ class Moderation(BaseCog):
     async def end_infraction(self, infraction):
         infraction.active = False
         await infraction.save()
-        self.handling.remove(infraction.id)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
@@ -4,13 +4,22 @@ from datetime import datetime
 
 from discord import Embed, User, NotFound, Forbidden, DMChannel
 from discord.ext import commands
+from tortoise import Tortoise
 
 from Bot import TheRealGearBot
 from Cogs.BaseCog import BaseCog
 from Util import Utils, GearbotLogging, Emoji, Translator, MessageUtils, server_info
 from Util.Converters import Duration, ReminderText
+from Util.Scheduler import Scheduler
 from database.DatabaseConnector import Reminder
 
+# how often to check the database for reminders the scheduler doesn't know about yet
+SWEEP_INTERVAL = 300
+# delivered reminders get cleaned up in batches
+CLEANUP_INTERVAL = 5
+# reminders without a guild get delivered by this cluster
+DM_CLUSTER = 0
+
 
 class Reminders(BaseCog):
 
@@ -19,10 +28,16 @@ class Reminders(BaseCog):
 
         self.running = True
         self.handling = set()
+        self.delivered = set()
+        self.scheduler = Scheduler("reminder delivery", self.deliver)
+        self.scheduler.start()
         self.bot.loop.create_task(self.delivery_service())
+        self.bot.loop.create_task(self.cleanup_service())
 
     def cog_unload(self):
         self.running = False
+        self.scheduler.stop()
+        self.bot.loop.create_task(self.cleanup())
 
     @commands.group(aliases=["r", "reminder"])
     async def remind(self, ctx):
@@ -72,50 +87,84 @@ class Reminders(BaseCog):
 
         else:
             dm = True
-        await Reminder.create(user_id=ctx.author.id, channel_id=ctx.channel.id, dm=dm,
+        r = await Reminder.create(user_id=ctx.author.id, channel_id=ctx.channel.id, dm=dm,
                         to_remind=await Utils.clean(reminder, markdown=False, links=False, emoji=False),
                         time=time.time() + duration_seconds, send=datetime.now().timestamp(), status=1,
                         guild_id=ctx.guild.id if ctx.guild is not None else "@me", message_id=ctx.message.id)
+        if self.is_ours(r.guild_id):
+            self.scheduler.schedule(r.id, r.time)
         mode = "dm" if dm else "here"
         await MessageUtils.send_to(ctx, "YES", f"reminder_confirmation_{mode}", duration=duration.length,
                                      duration_identifier=duration.unit)
 
+    def is_ours(self, guild_id):
+        # reminders are delivered by the cluster that has the guild, the ones from DMs by the designated cluster
+        if guild_id == "@me":
+            return self.bot.cluster == DM_CLUSTER
+        return ((int(guild_id) >> 22) % self.bot.total_shards) in self.bot.shard_ids
+
+    async def get_due(self, before):
+        shards = ", ".join(["%s"] * len(self.bot.shard_ids))
+        query = f"SELECT id, `time` FROM reminder WHERE status = 1 AND `time` < %s AND ((guild_id != '@me' AND MOD(CAST(guild_id AS UNSIGNED) >> 22, %s) IN ({shards}))"
+        if self.bot.cluster == DM_CLUSTER:
+            query += " OR guild_id = '@me'"
+        query += ")"
+        return await Tortoise.get_connection("default").execute_query_dict(query, [before, self.bot.total_shards, *self.bot.shard_ids])
+
     async def delivery_service(self):
-        # only let cluster 0 do this one
-        if self.bot.cluster is not 0:
-            return
         GearbotLogging.info("📬 Starting reminder delivery background task 📬")
+        # new reminders get scheduled when they are made, this picks up everything from before a restart
         while self.running:
-            now = time.time()
-            limit = datetime.fromtimestamp(time.time() + 30).timestamp()
-
-            for r in await Reminder.filter(time__lt = limit, status = 1):
-                if r.id not in self.handling:
-                    self.handling.add(r.id)
-                    self.bot.loop.create_task(
-                        self.run_after(r.time - now, self.deliver(r)))
-            await asyncio.sleep(10)
+            try:
+                due = await self.get_due(time.time() + SWEEP_INTERVAL * 2)
+            except Exception as ex:
+                # database might not be (re)connected yet after a hot reload, try again soon instead of waiting a full interval
+                GearbotLogging.exception("Failed to fetch due reminders", ex)
+                await asyncio.sleep(10)
+                continue
+            for r in due:
+                if r["id"] not in self.handling and r["id"] not in self.delivered:
+                    self.scheduler.schedule(r["id"], r["time"])
+            await asyncio.sleep(SWEEP_INTERVAL)
         GearbotLogging.info("📪 Reminder delivery background task terminated 📪")
 
-    async def run_after(self, delay, action):
-        if delay > 0:
-            await asyncio.sleep(delay)
-        if self.running:  # cog got terminated, new cog is now in charge of making sure this gets handled
-            await action
+    async def cleanup_service(self):
+        while self.running:
+            await asyncio.sleep(CLEANUP_INTERVAL)
+            await self.cleanup()
+
+    async def cleanup(self):
+        if len(self.delivered) == 0:
+            return
+        done = list(self.delivered)
+        await Reminder.filter(id__in=done).delete()
+        self.delivered.difference_update(done)
 
-    async def deliver(self, r):
-        channel = None
+    async def deliver(self, rid):
+        if rid in self.handling or rid in self.delivered:
+            return
+        self.handling.add(rid)
         try:
-            channel = await self.bot.fetch_channel(r.channel_id)
-        except (Forbidden, NotFound):
-            pass
-        dm = await self.bot.fetch_user(r.user_id)
-        first = dm if r.dm else channel
-        alternative = channel if r.dm else dm
-
-        if not await self.attempt_delivery(first, r):
-            await self.attempt_delivery(alternative, r)
-        await r.delete()
+            r = await Reminder.get_or_none(id=rid)
+            if r is None or r.status != 1:
+                return
+            channel = self.bot.get_channel(r.channel_id)
+            if channel is None:
+                try:
+                    channel = await self.bot.fetch_channel(r.channel_id)
+                except (Forbidden, NotFound):
+                    pass
+            dm = self.bot.get_user(r.user_id)
+            if dm is None:
+                dm = await self.bot.fetch_user(r.user_id)
+            first = dm if r.dm else channel
+            alternative = channel if r.dm else dm
+
+            if not await self.attempt_delivery(first, r):
+                await self.attempt_delivery(alternative, r)
+            self.delivered.add(rid)
+        finally:
+            self.handling.discard(rid)
 
     async def attempt_delivery(self, location, package):
         try:
@@ -960,8 +960,6 @@ class ServerAdmin(BaseCog):
             censor_list.append(word.lower())
             await MessageUtils.send_to(ctx, "YES", "entry_added", entry=word)
             Configuration.save(ctx.guild.id)
-            if ctx.guild.id in self.bot.get_cog("Censor").regexes:
-                del self.bot.get_cog("Censor").regexes[ctx.guild.id]
 
     @word_censor_list.command("remove")
     async def word_censor_list_remove(self, ctx, *, word: str):
@@ -972,8 +970,6 @@ class ServerAdmin(BaseCog):
             censor_list.remove(word.lower())
             await MessageUtils.send_to(ctx, "YES", "entry_removed", entry=word)
             Configuration.save(ctx.guild.id)
-            if ctx.guild.id in self.bot.get_cog("Censor").regexes:
-                del self.bot.get_cog("Censor").regexes[ctx.guild.id]
 
 
     @configure.group()
@@ -0,0 +1,52 @@
+"""
+Offline migration of all guild configs to the current template version, so the bot doesn't have to do it
+one guild at a time while handling events. Stop the bot first and run from the repository root:
+
+python3 GearBot/MigrateConfigs.py [--processes 4]
+"""
+import os
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool, cpu_count
+
+from Util import Configuration, Utils
+
+
+def migrate_file(args):
+    guild, target = args
+    try:
+        config = Utils.fetch_from_disk(f"config/{guild}")
+        # empty or too old to migrate, the bot resets these when it loads them
+        if len(config) == 0 or ("VERSION" not in config and len(config) < 15):
+            return "skipped"
+        if "VERSION" not in config:
+            config["VERSION"] = 0
+        if config["VERSION"] >= target:
+            return "current"
+        Configuration.backup_config(guild, config)
+        Configuration.migrate_config(config, target)
+        Utils.save_to_disk(f"config/{guild}", config)
+        return "migrated"
+    except Exception as ex:
+        print(f"\nFailed to migrate the config for {guild}: {ex}")
+        return "failed"
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--processes", type=int, default=cpu_count(), help="How many processes to migrate with")
+    clargs = parser.parse_args()
+
+    target = Utils.fetch_from_disk("config/template")["VERSION"]
+    guilds = [f[:-5] for f in os.listdir("config") if f.endswith(".json") and f[:-5].isdigit()]
+    print(f"Migrating {len(guilds)} configs to version {target} with {clargs.processes} processes")
+
+    start = time.perf_counter()
+    results = dict(migrated=0, current=0, skipped=0, failed=0)
+    with Pool(clargs.processes) as pool:
+        for done, result in enumerate(pool.imap_unordered(migrate_file, [(g, target) for g in guilds], chunksize=50), start=1):
+            results[result] += 1
+            if done % 100 == 0 or done == len(guilds):
+                print(f"\r{done}/{len(guilds)} configs processed", end="", flush=True)
+    print()
+    print(", ".join(f"{count} {result}" for result, count in results.items()) + f" in {round(time.perf_counter() - start, 2)}s")
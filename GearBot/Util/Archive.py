@@ -1,7 +1,8 @@
-import asyncio
 import datetime
 import io
-import os
+import tempfile
+import threading
+import zlib
 
 import discord
 
@@ -9,22 +10,137 @@ from Util import Utils, GearbotLogging, Translator, Emoji
 
 archive_counter = 0
 
+# archives stay in memory up to this size, bigger ones get spooled to disk while they are being written
+SPOOL_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+DEFAULT_UPLOAD_LIMIT = 8 * 1024 * 1024
+
+
+class ArchiveWriter:
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode()
+        self.file.write(data)
+        self.size += len(data)
+
+    def finish(self, filename, limit=DEFAULT_UPLOAD_LIMIT):
+        """
+        returns the finished archive, gzipped if it doesn't fit in the upload limit as plain text
+        or None if it doesn't even fit when gzipped
+        """
+        file, size = self.file, self.size
+        if size > limit:
+            # compress chunk by chunk into a new spool so the whole thing never has to be in memory
+            compressor = zlib.compressobj(wbits=31)  # gzip container
+            file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+            self.file.seek(0)
+            chunk = self.file.read(CHUNK_SIZE)
+            while len(chunk) > 0:
+                file.write(compressor.compress(chunk))
+                chunk = self.file.read(CHUNK_SIZE)
+            file.write(compressor.flush())
+            self.file.close()
+            size = file.tell()
+            filename = f"{filename}.gz"
+        if size > limit:
+            file.close()
+            return None
+        if size <= SPOOL_SIZE:
+            # still in memory anyways
+            file.seek(0)
+            data = file.read()
+            file.close()
+            return Archive(filename, size, data=data)
+        return Archive(filename, size, file=file)
+
+
+class Archive:
+    """
+    a finished archive, every upload opens its own reader on it
+    small ones are kept as immutable bytes, big ones stay in their temp file and get streamed from there
+    the temp file gets cleaned up once the archive and all its readers are garbage collected
+    """
+
+    def __init__(self, filename, size, data=None, file=None):
+        self.filename = filename
+        self.size = size
+        self.data = data
+        self.file = file
+        self.lock = threading.Lock()
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        # buffered reader so aiohttp can get the size from the file descriptor
+        return io.BufferedReader(ArchiveReader(self))
+
+    def to_file(self):
+        return discord.File(self.open(), self.filename)
+
+
+class ArchiveReader(io.RawIOBase):
+    """
+    read position of its own on the shared temp file, aiohttp reads uploads from executor threads
+    """
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.archive.file.fileno()
+
+    def readinto(self, buffer):
+        with self.archive.lock:
+            self.archive.file.seek(self.position)
+            data = self.archive.file.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.archive.size
+        self.position = offset
+        return offset
+
+    def tell(self):
+        return self.position
+
+
+def upload_limit(guild):
+    return guild.filesize_limit if guild is not None else DEFAULT_UPLOAD_LIMIT
+
+
 async def archive_purge(bot, guild_id, messages):
     global archive_counter
     archive_counter += 1
     channel = bot.get_channel(list(messages.values())[0].channel)
-    out = f"purged at {datetime.datetime.now()} from {channel.name}\n"
-    out += await pack_messages(messages.values())
-    buffer = io.BytesIO()
-    buffer.write(out.encode())
-    GearbotLogging.log_key(guild_id, 'purged_log', count=len(messages), channel=channel.mention, file=(buffer, "Purged messages archive.txt"))
-
-async def pack_messages(messages):
-    out = ""
+    writer = ArchiveWriter()
+    writer.write(f"purged at {datetime.datetime.now()} from {channel.name}\n")
+    await pack_messages(writer, messages.values())
+    archive = writer.finish("Purged messages archive.txt", upload_limit(bot.get_guild(guild_id)))
+    tag_on = Translator.translate('archive_too_big', guild_id) if archive is None else None
+    GearbotLogging.log_key(guild_id, 'purged_log', count=len(messages), channel=channel.mention, file=archive, tag_on=tag_on)
+
+async def pack_messages(writer, messages):
+    messages = list(messages)
+    names = await Utils.usernames([message.author for message in messages], clean=False)
     for message in messages:
-        name = await Utils.username(message.author, clean=False)
-        out += f"{discord.Object(message.messageid).created_at} {message.server} - {message.channel} - {message.messageid} | {name} ({message.author}) | {message.content} | {(', '.join(Utils.assemble_attachment(message.channel, attachment.id, attachment.name) for attachment in message.attachments))}\r\n"
-    return out
+        writer.write(f"{discord.Object(message.messageid).created_at} {message.server} - {message.channel} - {message.messageid} | {names[message.author]} ({message.author}) | {message.content} | {(', '.join(Utils.assemble_attachment(message.channel, attachment.id, attachment.name) for attachment in message.attachments))}\r\n")
 
 async def ship_messages(ctx, messages, t, filename="Message archive"):
     if len(messages) > 0:
@@ -36,10 +152,12 @@ async def ship_messages(ctx, messages, t, filename="Message archive"):
         messages = []
         for mid, message in sorted(message_list.items()):
             messages.append(message)
-        out = await pack_messages(messages)
-        buffer = io.BytesIO()
-        buffer.write(out.encode())
-        buffer.seek(0)
-        await ctx.send(f"{Emoji.get_chat_emoji('YES')} {Translator.translate('archived_count', ctx, count=len(messages))}", file=discord.File(fp=buffer, filename=f"{filename}.txt"))
+        writer = ArchiveWriter()
+        await pack_messages(writer, messages)
+        archive = writer.finish(f"{filename}.txt", upload_limit(ctx.guild))
+        if archive is None:
+            await ctx.send(f"{Emoji.get_chat_emoji('WARNING')} {Translator.translate('archive_too_big', ctx)}")
+            return
+        await ctx.send(f"{Emoji.get_chat_emoji('YES')} {Translator.translate('archived_count', ctx, count=len(messages))}", file=archive.to_file())
     else:
-        await ctx.send(f"{Emoji.get_chat_emoji('WARNING')} {Translator.translate(f'archive_empty_{t}', ctx)}")
\ No newline at end of file
+        await ctx.send(f"{Emoji.get_chat_emoji('WARNING')} {Translator.translate(f'archive_empty_{t}', ctx)}")
@@ -0,0 +1,120 @@
+from Util import Configuration
+
+MATCHERS = dict()
+
+
+class Automaton:
+    """
+    aho-corasick automaton, finds every pattern in a single pass over the text
+    no matter how many patterns there are
+    """
+
+    def __init__(self, patterns):
+        self.goto = [dict()]
+        self.fail = [0]
+        self.output = [None]
+        self.dict_suffix = [None]
+        for pattern in patterns:
+            self._add(pattern)
+        self._link()
+
+    def __len__(self):
+        return len(self.goto) - 1
+
+    def _add(self, pattern):
+        node = 0
+        for c in pattern:
+            nxt = self.goto[node].get(c)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][c] = nxt
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_suffix.append(None)
+            node = nxt
+        self.output[node] = pattern
+
+    def _link(self):
+        # breadth first so the fail link of a node's parent is always done before the node itself
+        queue = list(self.goto[0].values())
+        dict_suffix = self.dict_suffix
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for c, child in self.goto[node].items():
+                f = self.fail[node]
+                while f != 0 and c not in self.goto[f]:
+                    f = self.fail[f]
+                fail = self.goto[f].get(c, 0)
+                self.fail[child] = fail
+                dict_suffix[child] = fail if self.output[fail] is not None else dict_suffix[fail]
+                queue.append(child)
+
+    def finditer(self, text):
+        """
+        yields (end index, pattern) for every match, in order of where they end
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        dict_suffix = self.dict_suffix
+        node = 0
+        for i, c in enumerate(text):
+            while node != 0 and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            hit = node if output[node] is not None else dict_suffix[node]
+            while hit is not None:
+                yield i + 1, output[hit]
+                hit = dict_suffix[hit]
+
+
+def is_word_char(c):
+    return c.isalnum() or c == "_"
+
+
+def is_boundary(text, index):
+    # same rules as \b in a regex: one side is a word char, the other one isn't (or is the edge)
+    before = index > 0 and is_word_char(text[index - 1])
+    after = index < len(text) and is_word_char(text[index])
+    return before != after
+
+
+class GuildMatcher:
+
+    def __init__(self, tokens, words, full_messages):
+        self.tokens = Automaton(t.lower() for t in tokens if t != "")
+        self.words = Automaton(w.lower() for w in words if w != "")
+        self.full_messages = frozenset(full_messages)
+
+    def find_token(self, content):
+        if len(self.tokens) == 0:
+            return None
+        for _, token in self.tokens.finditer(content):
+            return token
+        return None
+
+    def find_word(self, content):
+        if len(self.words) == 0:
+            return None
+        for end, word in self.words.finditer(content):
+            if is_boundary(content, end - len(word)) and is_boundary(content, end):
+                return word
+        return None
+
+    def is_full_message(self, content):
+        return content in self.full_messages
+
+
+def get_matcher(guild_id):
+    if guild_id not in MATCHERS:
+        MATCHERS[guild_id] = GuildMatcher(Configuration.get_var(guild_id, "CENSORING", "TOKEN_CENSORLIST"),
+                                          Configuration.get_var(guild_id, "CENSORING", "WORD_CENSORLIST"),
+                                          Configuration.get_var(guild_id, "CENSORING", "FULL_MESSAGE_LIST"))
+    return MATCHERS[guild_id]
+
+
+def invalidate(guild_id):
+    MATCHERS.pop(guild_id, None)
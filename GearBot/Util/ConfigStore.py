@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+from Util import Utils, GearbotLogging
+from database import DatabaseConnector
+
+
+class FileStore:
+    """
+    one json file per guild in the config folder
+    """
+    sync_loads = True
+
+    def load_sync(self, guild_id):
+        config = Utils.fetch_from_disk(f"config/{guild_id}")
+        return config if len(config) > 0 else None
+
+    async def load(self, guild_id):
+        return await asyncio.get_event_loop().run_in_executor(None, self.load_sync, guild_id)
+
+    async def load_many(self, guild_ids):
+        loop = asyncio.get_event_loop()
+        configs = await asyncio.gather(*[loop.run_in_executor(None, self.load_sync, guild_id) for guild_id in guild_ids])
+        return {guild_id: config for guild_id, config in zip(guild_ids, configs) if config is not None}
+
+    async def save(self, guild_id, config):
+        await Utils.save_to_disk_async(f"config/{guild_id}", config)
+
+
+class SQLStore:
+    """
+    one row per guild in the guildconfig table
+    """
+    sync_loads = False
+
+    async def load(self, guild_id):
+        row = await DatabaseConnector.GuildConfig.get_or_none(guild_id=guild_id)
+        return json.loads(row.config) if row is not None else None
+
+    async def load_many(self, guild_ids):
+        return {row.guild_id: json.loads(row.config) for row in await DatabaseConnector.GuildConfig.filter(guild_id__in=guild_ids)}
+
+    async def save(self, guild_id, config):
+        data = json.dumps(config, skipkeys=True)
+        row = await DatabaseConnector.GuildConfig.get_or_none(guild_id=guild_id)
+        if row is None:
+            await DatabaseConnector.GuildConfig.create(guild_id=guild_id, config=data)
+        else:
+            row.config = data
+            await row.save()
+
+
+class RedisStore:
+    """
+    all configs in a single redis hash, keyed by guild id
+    """
+    sync_loads = False
+    KEY = "guild_configs"
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def load(self, guild_id):
+        config = await self.redis.hget(self.KEY, guild_id)
+        return json.loads(config) if config is not None else None
+
+    async def load_many(self, guild_ids):
+        configs = await self.redis.hmget(self.KEY, *guild_ids)
+        return {guild_id: json.loads(config) for guild_id, config in zip(guild_ids, configs) if config is not None}
+
+    async def save(self, guild_id, config):
+        await self.redis.hset(self.KEY, guild_id, json.dumps(config, skipkeys=True))
+
+
+class ImportingStore:
+    """
+    wraps the sql or redis store when switching over from config files: guilds it doesn't have a config for yet
+    get theirs from the config folder, and it gets written to the new store right away
+    """
+    sync_loads = False
+
+    def __init__(self, store, files):
+        self.store = store
+        self.files = files
+
+    async def load(self, guild_id):
+        config = await self.store.load(guild_id)
+        if config is None:
+            config = await self.files.load(guild_id)
+            if config is not None:
+                await self.store.save(guild_id, config)
+        return config
+
+    async def load_many(self, guild_ids):
+        configs = await self.store.load_many(guild_ids)
+        missing = [guild_id for guild_id in guild_ids if guild_id not in configs]
+        if len(missing) > 0:
+            imported = await self.files.load_many(missing)
+            for guild_id, config in imported.items():
+                await self.store.save(guild_id, config)
+            if len(imported) > 0:
+                GearbotLogging.info(f"Imported {len(imported)} guild configs from the config folder")
+            configs.update(imported)
+        return configs
+
+    async def save(self, guild_id, config):
+        await self.store.save(guild_id, config)
+
+
+def get_store(backend, redis=None):
+    """
+    store for the configured backend (the CONFIG_BACKEND master var)
+    """
+    if backend == "SQL":
+        return ImportingStore(SQLStore(), FileStore())
+    if backend == "REDIS":
+        if redis is not None:
+            return ImportingStore(RedisStore(redis), FileStore())
+        GearbotLogging.error("Redis config backend configured but redis is unavailable, falling back to config files")
+    return FileStore()
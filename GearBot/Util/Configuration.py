@@ -42,12 +42,16 @@ def get_master_var(key, default=None):
     return MASTER_CONFIG[key]
 
 
+import asyncio
+import copy
 import json
 import os
+import time
+from concurrent.futures import CancelledError
 
 from discord.ext import commands
 
-from Util import GearbotLogging, Utils, Features
+from Util import GearbotLogging, Utils, Features, CensorMatcher, ConfigStore, Permissioncheckers
 
 
 def initial_migration(config):
@@ -369,37 +373,99 @@ def move_keys(config, section, *keys):
 MIGRATORS = [initial_migration, v2, v3, v4, v5, v6, v7, v8, v9, v10, v11, v12, v13, v14, v15, v16, v17, v18, v19, v20, v21, v22, v23, v24, v25, v25, v26, v27, v28]
 
 BOT = None
+# picked by initialize, config files until then
+BACKEND = None
+# guild id -> task that will write it out, multiple saves in a row end up as a single write
+PENDING_SAVES = dict()
+PENDING_LOADS = dict()
+SAVE_DELAY = 1
+CONFIG_CHANNEL = "config-updates"
 
 
 async def initialize(bot: commands.Bot):
-    global CONFIG_VERSION, BOT, TEMPLATE
+    global CONFIG_VERSION, BOT, TEMPLATE, BACKEND
     BOT = bot
     TEMPLATE = Utils.fetch_from_disk("config/template")
     CONFIG_VERSION = TEMPLATE["VERSION"]
     GearbotLogging.info(f"Current template config version: {CONFIG_VERSION}")
-    # GearbotLogging.info(f"Loading configurations for {len(bot.guilds)} guilds.")
-    # for guild in bot.guilds:
-    #     GearbotLogging.info(f"Loading info for {guild.name} ({guild.id}).")
-    #     load_config(guild.id)
-    #     validate_config(guild.id)
+    BACKEND = ConfigStore.get_store(get_master_var("CONFIG_BACKEND", "FILE"), bot.redis_pool)
+    # other clusters tell us when they changed a config
+    if bot.config_listener is not None:
+        bot.config_listener.cancel()
+        bot.config_listener = None
+    if bot.redis_pool is not None:
+        bot.config_listener = bot.loop.create_task(listen(bot.redis_pool))
+
+
+def get_backend():
+    global BACKEND
+    if BACKEND is None:
+        BACKEND = ConfigStore.FileStore()
+    return BACKEND
 
 
 def load_config(guild):
+    prepare_config(guild, get_backend().load_sync(guild))
+
+
+async def load_config_async(guild):
+    # multiple requests for the same guild can come in while we wait for the backend, only fetch once
+    if guild not in PENDING_LOADS:
+        PENDING_LOADS[guild] = asyncio.ensure_future(get_backend().load(guild))
+    task = PENDING_LOADS[guild]
+    try:
+        config = await asyncio.shield(task)
+    finally:
+        if PENDING_LOADS.get(guild) is task and task.done():
+            del PENDING_LOADS[guild]
+    if guild not in PENDING_SAVES:
+        prepare_config(guild, config)
+
+
+async def preload(guild_ids):
+    """
+    loads the configs of all these guilds in bulk so event handlers never have to wait for them
+    """
+    missing = [guild for guild in guild_ids if guild not in SERVER_CONFIGS]
+    for chunk in Utils.chunks(missing, 500):
+        configs = await get_backend().load_many(chunk)
+        for guild in chunk:
+            if guild not in SERVER_CONFIGS:
+                prepare_config(guild, configs.get(guild))
+    GearbotLogging.info(f"Preloaded {len(missing)} guild configs")
+
+
+async def restore(configs, guild_ids):
+    """
+    prepares the configs we already had before a hot reload again, and loads whatever is still missing
+    """
+    for guild, config in list(configs.items()):
+        prepare_config(guild, config)
+    await preload(guild_ids)
+
+
+def prepare_config(guild, config):
     global SERVER_CONFIGS
-    config = Utils.fetch_from_disk(f'config/{guild}')
+    if config is None:
+        config = dict()
     if len(config.keys()) != 0 and "VERSION" not in config and len(config) < 15:
         GearbotLogging.info(f"The config for {guild} is to old to migrate, resetting")
         config = dict()
     elif len(config.keys()) != 0:
         if "VERSION" not in config:
             config["VERSION"] = 0
+        migrate = config["VERSION"] < CONFIG_VERSION
         SERVER_CONFIGS[guild] = update_config(guild, config)
+        if migrate:
+            save(guild)
     if len(config.keys()) is 0:
         GearbotLogging.info(f"No config available for {guild}, creating a blank one.")
-        SERVER_CONFIGS[guild] = Utils.fetch_from_disk("config/template")
+        SERVER_CONFIGS[guild] = copy.deepcopy(TEMPLATE)
         save(guild)
     validate_config(guild)
     Features.check_server(guild)
+    CensorMatcher.invalidate(guild)
+    Permissioncheckers.invalidate_guild(guild)
 
 
 def validate_config(guild_id):
@@ -428,17 +494,26 @@ def checklist(guid, key, getter):
 
 
 def update_config(guild, config):
-    while config["VERSION"] < CONFIG_VERSION:
-        v = config["VERSION"]
-        GearbotLogging.info(f"Upgrading config version from version {v} to {v + 1}")
-        d = f"config/backups/v{v}"
-        if not os.path.isdir(d):
-            os.makedirs(d)
-        Utils.save_to_disk(f"{d}/{guild}", config)
+    v = config["VERSION"]
+    if v < CONFIG_VERSION:
+        GearbotLogging.info(f"Upgrading config for {guild} from version {v} to {CONFIG_VERSION}")
+        # a single backup of what it looked like before, no matter how many versions it skips
+        backup_config(guild, config)
+        migrate_config(config, CONFIG_VERSION)
+    return config
+
+
+def backup_config(guild, config):
+    d = f"config/backups/v{config['VERSION']}"
+    if not os.path.isdir(d):
+        os.makedirs(d, exist_ok=True)
+    Utils.save_to_disk(f"{d}/{guild}", config)
+
+
+def migrate_config(config, target):
+    while config["VERSION"] < target:
         MIGRATORS[config["VERSION"]](config)
         config["VERSION"] += 1
-        Utils.save_to_disk(f"config/{guild}", config)
-
     return config
 
 
@@ -447,6 +522,11 @@ def get_var(id, section, key=None, default=None):
         raise ValueError("Where is this coming from?")
     if not id in SERVER_CONFIGS.keys():
         GearbotLogging.info(f"Config entry requested before config was loaded for guild {id}, loading config for it")
+        if not get_backend().sync_loads:
+            # can't wait for the backend here, hand out the defaults until it arrives
+            asyncio.ensure_future(load_config_async(id))
+            s = copy.deepcopy(TEMPLATE.get(section, {}))
+            return s.get(key, default) if key is not None else s
         load_config(id)
     s = SERVER_CONFIGS[id].get(section, {})
     if key is not None:
@@ -467,10 +547,73 @@ def set_cat(id, cat, value):
 
 
 def save(id):
-    global SERVER_CONFIGS
-    with open(f'config/{id}.json', 'w') as jsonfile:
-        jsonfile.write((json.dumps(SERVER_CONFIGS[id], indent=4, skipkeys=True, sort_keys=True)))
     Features.check_server(id)
+    CensorMatcher.invalidate(id)
+    Permissioncheckers.invalidate_guild(id)
+    if id not in PENDING_SAVES:
+        PENDING_SAVES[id] = asyncio.ensure_future(delayed_save(id))
+    elif BOT is not None:
+        BOT.metrics.config_saves.labels(result="coalesced").inc()
+
+
+async def delayed_save(guild):
+    await asyncio.sleep(SAVE_DELAY)
+    del PENDING_SAVES[guild]
+    await write(guild)
+
+
+async def write(guild):
+    start = time.perf_counter()
+    try:
+        await get_backend().save(guild, SERVER_CONFIGS[guild])
+    except Exception as ex:
+        if BOT is not None:
+            BOT.metrics.config_saves.labels(result="failed").inc()
+        GearbotLogging.exception(f"Failed to save the config for {guild}", ex)
+        return
+    if BOT is None:
+        return
+    BOT.metrics.config_saves.labels(result="written").inc()
+    BOT.metrics.config_save_latency.observe(time.perf_counter() - start)
+    if BOT.redis_pool is not None:
+        try:
+            await BOT.redis_pool.publish_json(CONFIG_CHANNEL, dict(cluster=BOT.cluster, guild_id=guild))
+        except OSError as ex:
+            GearbotLogging.exception(f"Failed to announce config change for {guild}", ex)
+
+
+async def flush():
+    """
+    writes out all pending saves right away, for shutdown and reloads
+    """
+    pending = list(PENDING_SAVES.items())
+    for guild, task in pending:
+        task.cancel()
+        del PENDING_SAVES[guild]
+    for guild, _ in pending:
+        await write(guild)
+
+
+async def listen(redis):
+    channel, = await redis.subscribe(CONFIG_CHANNEL)
+    try:
+        while await channel.wait_message():
+            message = await channel.get_json()
+            guild = message["guild_id"]
+            # our own changes, or ones we are about to overwrite anyways
+            if message["cluster"] == BOT.cluster or guild in PENDING_SAVES:
+                continue
+            if BOT.get_guild(guild) is None:
+                SERVER_CONFIGS.pop(guild, None)
+                continue
+            try:
+                await load_config_async(guild)
+            except Exception as ex:
+                GearbotLogging.exception(f"Failed to reload the config for {guild} after it changed elsewhere", ex)
+    except CancelledError:
+        pass  # reloading or shutting down
+    finally:
+        await redis.unsubscribe(CONFIG_CHANNEL)
 
 
 def load_persistent():
@@ -218,7 +218,7 @@ VALIDATORS = {
             check_type(str),
             lambda g, v, *_: "Prefix too long" if len(v) > 10 else "Prefix can't be blank" if len(v) is 0 else True),
 
-        "LANG": lambda g, v, *_: v in Translator.LANGS or "Unknown language",
+        "LANG": lambda g, v, *_: v in Translator.LANG_NAMES or "Unknown language",
         "PERM_DENIED_MESSAGE": check_type(bool),
         "TIMESTAMPS": check_type(bool),
         "NEW_USER_THRESHOLD": multicheck(check_type(int), check_number_range(0, 60 * 60 * 24 * 14)),
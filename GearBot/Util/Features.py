@@ -1,13 +1,68 @@
-from Util import Configuration
+import pytz
+
+from Util import Configuration, GearbotLogging
 
 LOG_MAP = dict()
+LOG_ROUTES = dict()
+STAMP_ZONES = dict()
+GUILD_PREFIXES = dict()
 
 
 def check_server(guild_id):
     enabled = set()
-    for cid, info in Configuration.get_var(guild_id, "LOG_CHANNELS").items():
+    channels = Configuration.get_var(guild_id, "LOG_CHANNELS")
+    for cid, info in channels.items():
         enabled.update(info["CATEGORIES"])
     LOG_MAP[guild_id] = enabled
+    build_routes(guild_id, channels)
+    resolve_stamp_zone(guild_id)
+    GUILD_PREFIXES[guild_id] = Configuration.get_var(guild_id, "GENERAL", "PREFIX")
+
+
+def build_routes(guild_id, channels):
+    # log types are only known once logging is initialized, resolve lazily from get_log_targets until then
+    if len(GearbotLogging.LOG_TYPES) == 0:
+        LOG_ROUTES.pop(guild_id, None)
+        return None
+    settings = [(cid, set(info["CATEGORIES"]), set(info["DISABLED_KEYS"])) for cid, info in channels.items()]
+    routes = dict()
+    for key, info in GearbotLogging.LOG_TYPES.items():
+        targets = tuple(cid for cid, categories, disabled in settings if
+                        info.category in categories and info.config_key not in disabled)
+        if len(targets) > 0:
+            routes[key] = targets
+    LOG_ROUTES[guild_id] = routes
+    return routes
+
+
+def get_log_targets(guild_id, key):
+    routes = LOG_ROUTES.get(guild_id)
+    if routes is None:
+        routes = build_routes(guild_id, Configuration.get_var(guild_id, "LOG_CHANNELS"))
+        if routes is None:
+            return ()
+    return routes.get(key, ())
+
+
+def resolve_stamp_zone(guild_id):
+    # None when the guild doesn't want timestamps on its logs
+    zone = None
+    if Configuration.get_var(guild_id, "GENERAL", "TIMESTAMPS"):
+        zone = pytz.timezone(Configuration.get_var(guild_id, "GENERAL", "TIMEZONE"))
+    STAMP_ZONES[guild_id] = zone
+    return zone
+
+
+def get_prefix(guild_id):
+    if guild_id not in GUILD_PREFIXES:
+        GUILD_PREFIXES[guild_id] = Configuration.get_var(guild_id, "GENERAL", "PREFIX")
+    return GUILD_PREFIXES[guild_id]
+
+
+def get_stamp_zone(guild_id):
+    if guild_id not in STAMP_ZONES:
+        return resolve_stamp_zone(guild_id)
+    return STAMP_ZONES[guild_id]
 
 
 def is_logged(guild, feature):
@@ -1,23 +1,22 @@
-import io
+import asyncio
 import logging
 import os
 import sys
+import time
 import traceback
-from collections import namedtuple
+from collections import namedtuple, deque
 from concurrent.futures import CancelledError
 from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
-from queue import Queue
 
 import discord
-import pytz
 import sentry_sdk
 from aiohttp import ClientOSError, ServerDisconnectedError
 from discord import ConnectionClosed, AllowedMentions
 from discord.ext import commands
 
 from Bot import TheRealGearBot
-from Util import Configuration, Utils, MessageUtils
+from Util import Configuration, Utils, MessageUtils, Features
 
 LOGGER = logging.getLogger('gearbot')
 DISCORD_LOGGER = logging.getLogger('discord')
@@ -260,6 +259,15 @@ LOGGING_INFO = {
 LOG_TYPES = dict()
 
 LOG_QUEUE = dict()
+LOG_PUMPS = dict()
+LOG_SENDS = dict()
+STAMPS = dict()
+
+# how long to wait for more log messages to pack into the same send
+COALESCE_WINDOW = 0.25
+# discord allows 5 messages per 5 seconds in a channel
+CHANNEL_SENDS = 5
+CHANNEL_PERIOD = 5
 
 
 def before_send(event, hint):
@@ -327,6 +335,8 @@ async def initialize(bot: commands.Bot, channelID):
                     LOG_TYPES[inner] = log_type(k, cat, emoji)
             else:
                 LOG_TYPES[k] = log_type(k, cat, v)
+    # routing tables are built from the log types, start over with the fresh ones
+    Features.LOG_ROUTES.clear()
 
 
 def debug(message):
@@ -363,45 +373,32 @@ async def bot_log(message=None, embed=None):
 
 
 def log_raw(guild_id, key, message=None, embed=None, file=None):
-    # logging category, emoji and
-    info = LOG_TYPES[key]
-
-    # determine where it should be logged so we don't need to bother assembling everything when it's just gona be voided anyways
-    targets = []
-    channels = Configuration.get_var(guild_id, "LOG_CHANNELS")
-    for cid, settings in channels.items():
-        if info.category in settings["CATEGORIES"] and info.config_key not in settings["DISABLED_KEYS"]:
-            targets.append(cid)
+    # determine where it should be logged, precomputed per guild
+    targets = Features.get_log_targets(guild_id, key)
 
     # no targets? no logging
-    if len(targets) is 0:
+    if len(targets) == 0:
         return
     log_to(guild_id, targets, Utils.trim_message(message, 2000) if message is not None else None, embed, file, None)
 
 
 def log_key(guild_id, key, embed=None, file=None, can_stamp=True, tag_on=None, **kwargs):
-    # logging category, emoji and
-    info = LOG_TYPES[key]
-
     # determine where it should be logged so we don't need to bother assembling everything when it's just gona be voided anyways
-    targets = []
-    channels = Configuration.get_var(guild_id, "LOG_CHANNELS")
-    for cid, settings in channels.items():
-        if info.category in settings["CATEGORIES"] and info.config_key not in settings["DISABLED_KEYS"]:
-            targets.append(cid)
+    targets = Features.get_log_targets(guild_id, key)
 
     # no targets? don't bother with assembly
-    if len(targets) is 0:
+    if len(targets) == 0:
         return
 
+    # logging category, emoji and
+    info = LOG_TYPES[key]
+
     message = MessageUtils.assemble(guild_id, info.emoji, key, **kwargs).replace('@', '@\u200b')
 
-    if can_stamp and Configuration.get_var(guild_id, 'GENERAL', "TIMESTAMPS"):
-        s = datetime.strftime(
-            datetime.now().astimezone(pytz.timezone(Configuration.get_var(guild_id, 'GENERAL', 'TIMEZONE'))),
-            '%H:%M:%S')
-        stamp = f"[``{s}``] "
-        message = Utils.trim_message(f'{stamp} {message}', 2000)
+    if can_stamp:
+        stamp = get_stamp(guild_id)
+        if stamp is not None:
+            message = Utils.trim_message(f'{stamp} {message}', 2000)
 
     if tag_on is not None:
         tag_on = tag_on.replace('@', '@\u200b')
@@ -415,68 +412,102 @@ def log_key(guild_id, key, embed=None, file=None, can_stamp=True, tag_on=None, *
     log_to(guild_id, targets, message, embed, file, tag_on)
 
 
+def get_stamp(guild_id):
+    zone = Features.get_stamp_zone(guild_id)
+    if zone is None:
+        return None
+    # the stamp only changes once a second, share it between all guilds in the same timezone
+    now = int(time.time())
+    cached = STAMPS.get(zone)
+    if cached is None or cached[0] != now:
+        s = datetime.fromtimestamp(now, zone).strftime('%H:%M:%S')
+        cached = STAMPS[zone] = (now, f"[``{s}``] ")
+    return cached[1]
+
+
 def log_to(guild_id, targets, message, embed, file, tag_on=None):
     for target in targets:
-        # make sure we have a queue and a running task
-        if target not in LOG_QUEUE:
-            LOG_QUEUE[target] = Queue()
-            BOT.loop.create_task(log_task(guild_id, target))
-
-        # duplicate the file bytes so it doesn't freak out when we try to send it twice
-        f = None
-        if file is not None:
-            buffer = file[0]
-            name = file[1]
-            buffer.seek(0)
-            b2 = io.BytesIO()
-            for line in buffer.readlines():
-                b2.write(line)
-            b2.seek(0)
-            f = discord.File(b2, name)
+        # every target needs its own file object, they all read from the same archive so nothing gets copied
+        f = file.to_file() if file is not None else None
 
         # actually adding to the queue
         if tag_on is None:
-            LOG_QUEUE[target].put(todo(message, embed, f))
+            queue_log(guild_id, target, todo(message, embed, f))
         else:
-            LOG_QUEUE[target].put(todo(message, None, None))
-            LOG_QUEUE[target].put(todo(tag_on, embed, f))
+            queue_log(guild_id, target, todo(message, None, None))
+            queue_log(guild_id, target, todo(tag_on, embed, f))
+
+
+def queue_log(guild_id, target, item):
+    if target not in LOG_QUEUE:
+        LOG_QUEUE[target] = asyncio.Queue()
+    LOG_QUEUE[target].put_nowait(item)
+    BOT.metrics.log_queue_depth.inc()
+    # make sure there is a pump running to deliver it
+    if target not in LOG_PUMPS:
+        LOG_PUMPS[target] = BOT.loop.create_task(log_task(guild_id, target))
+
+
+def drop_queue(target):
+    queue = LOG_QUEUE.pop(target, None)
+    if queue is not None:
+        BOT.metrics.log_queue_depth.dec(queue.qsize())
 
 
 async def log_task(guild_id, target):
+    queue = LOG_QUEUE[target]
     to_send = ""
-    todo = None
-    # keep pumping until we run out of messages
-    while not LOG_QUEUE[target].empty():
-        try:
+    item = None
+    try:
+        # keep pumping until we run out of messages
+        while not queue.empty():
             channel = BOT.get_channel(int(target))
             # channel no longer exists, abort and re-validate config to remove the invalid entry
             if channel is None:
-                del LOG_QUEUE[target]
+                drop_queue(target)
                 Configuration.validate_config(guild_id)
                 return
-            # pull message from queue
-            todo = LOG_QUEUE[target].get(block=False)
-            if (len(to_send) + len(todo.message) if todo.message is not None else 0) < 2000:
-                to_send = f'{to_send}\n{todo.message if todo.message is not None else ""}'
-            else:
-                # too large, send it out
-                await channel.send(to_send, allowed_mentions=AllowedMentions(everyone=False, users=False, roles=False))
-                to_send = todo.message
-            if todo.embed is not None or todo.file is not None or LOG_QUEUE[target].empty():
-                await channel.send(to_send, embed=todo.embed, file=todo.file, allowed_mentions=AllowedMentions(everyone=False, users=False, roles=False))
+            # give bursts a moment to pile up so they go out in as few messages as possible
+            await asyncio.sleep(COALESCE_WINDOW)
+            while not queue.empty():
+                item = queue.get_nowait()
+                BOT.metrics.log_queue_depth.dec()
+                message = item.message if item.message is not None else ""
+                if len(to_send) + len(message) + 1 > 2000:
+                    # too large, send out what we have so far
+                    await send_log(target, channel, to_send)
+                    to_send = ""
+                to_send = f"{to_send}\n{message}" if to_send != "" else message
+                if item.embed is not None or item.file is not None:
+                    await send_log(target, channel, to_send, item.embed, item.file)
+                    to_send = ""
+            if to_send != "":
+                await send_log(target, channel, to_send)
                 to_send = ""
-        except discord.Forbidden:
-            # someone screwed up their permissions, not my problem, will show an error in the dashboard
-            del LOG_QUEUE[target]
-            return
-        except CancelledError:
-            return  # bot is terminating
-        except Exception as e:
-            del LOG_QUEUE[target]
-            await TheRealGearBot.handle_exception("LOG PUMP", BOT, e,
-                                                  cid=target, todo=todo, to_send=to_send)
-            return
-    del LOG_QUEUE[target]
+    except discord.Forbidden:
+        # someone screwed up their permissions, not my problem, will show an error in the dashboard
+        drop_queue(target)
+    except CancelledError:
+        pass  # bot is terminating
+    except Exception as e:
+        drop_queue(target)
+        await TheRealGearBot.handle_exception("LOG PUMP", BOT, e,
+                                              cid=target, todo=item, to_send=to_send)
+    finally:
+        del LOG_PUMPS[target]
+
+
+async def send_log(target, channel, content, embed=None, file=None):
+    # stay within the channel's message rate limit instead of running into 429s, anything that comes in while we wait gets packed into the next send
+    sent = LOG_SENDS.setdefault(target, deque(maxlen=CHANNEL_SENDS))
+    if len(sent) == CHANNEL_SENDS:
+        wait = sent[0] + CHANNEL_PERIOD - time.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+    start = time.perf_counter()
+    await channel.send(content if content != "" else None, embed=embed, file=file, allowed_mentions=AllowedMentions(everyone=False, users=False, roles=False))
+    BOT.metrics.log_send_latency.observe(time.perf_counter() - start)
+    sent.append(time.time())
 
 
 async def message_owner(bot, message):
@@ -5,13 +5,16 @@ from datetime import datetime
 
 from aioredis import ReplyError
 from discord import NotFound
-from tortoise.query_utils import Q
+from tortoise import Tortoise
 
 from Bot import GearBot
-from Util import Pages, Utils, Translator, GearbotLogging, Emoji, ReactionManager
+from Util import Pages, Utils, Translator, GearbotLogging, Emoji
 from database.DatabaseConnector import Infraction
 
 bot:GearBot = None
+# scheduler that lifts timed infractions, registered by the moderation cog
+scheduler = None
+TIMED_TYPES = ["Mute", "Tempban"]
 
 def initialize(gearbot):
     global bot
@@ -20,41 +23,168 @@ def initialize(gearbot):
 async def add_infraction(guild_id, user_id, mod_id, type, reason, end=None, active=True):
     i = await Infraction.create(guild_id=guild_id, user_id=user_id, mod_id=mod_id, type=type, reason=reason,
                       start=datetime.now().timestamp(), end=end, active=active)
-    clear_cache(guild_id)
+    schedule_expiry(i)
+    clear_cache(guild_id, i)
     return i
 
-cleaners = dict()
 
-def clear_cache(guild_id):
-    if guild_id in cleaners:
-        cleaners[guild_id].cancel()
-    cleaners[guild_id] = bot.loop.create_task(cleaner(guild_id))
+def schedule_expiry(infraction):
+    """
+    (re)schedules lifting a timed infraction, call again whenever the end changes
+    """
+    if scheduler is not None and infraction.active and infraction.end is not None and infraction.type in TIMED_TYPES:
+        scheduler.schedule(infraction.id, infraction.end)
+
+
+async def get_expiring(before, shard_ids, total_shards):
+    """
+    ids and end times of active timed infractions for the guilds on the given shards that end before the given time
+    """
+    shards = ", ".join(["%s"] * len(shard_ids))
+    types = ", ".join(["%s"] * len(TIMED_TYPES))
+    return await Tortoise.get_connection("default").execute_query_dict(
+        f"SELECT id, `end` FROM infraction WHERE `type` IN ({types}) AND active = 1 AND `end` < %s "
+        f"AND MOD(guild_id >> 22, %s) IN ({shards})",
+        [*TIMED_TYPES, before, total_shards, *shard_ids])
 
+cleaners = dict()
+# infractions that changed per guild since the last cleanup, None if anything could have changed
+changes = dict()
+
+def clear_cache(guild_id, *infractions):
+    """
+    drops the cached searches the given infractions could show up in, or all of them if none are given
+    pass both the old and new version of an infraction when it gets edited
+    """
+    if len(infractions) == 0 or changes.get(guild_id, []) is None:
+        changes[guild_id] = None
+    else:
+        changes.setdefault(guild_id, []).extend(infractions)
+    if guild_id not in cleaners:
+        cleaners[guild_id] = bot.loop.create_task(cleaner(guild_id))
 
 
 async def cleaner(guild_id):
-    # sleep a bit first, we're not in a rush
+    # sleep a bit first, we're not in a rush and this way a burst of infractions only needs one cleanup
     await asyncio.sleep(5)
-    todo = await inf_cleaner(guild_id, reset_cache=True)
-    for view in sorted(todo, key=lambda l: l[0], reverse=True):
-        await ReactionManager.on_reaction(bot, view[0], view[1], 0, "🔁")
-    if guild_id in cleaners:
-        del cleaners[guild_id]
+    del cleaners[guild_id]
+    # open views are not refreshed, they rebuild their pages on the next reaction
+    await inf_cleaner(guild_id, reset_cache=True, infractions=changes.pop(guild_id, None))
+
+
+def could_match(query, fields, infraction):
+    """
+    if the infraction could show up in the results of a search, mirrors search_infractions
+    """
+    if query is None or query == "":
+        return True
+    fields = fields.split("-") if fields is not None else []
+    numeric = query.isnumeric()
+    checks = []
+    if "[user]" in fields and numeric:
+        checks.append(infraction.user_id == int(query))
+    if "[mod]" in fields and numeric:
+        checks.append(infraction.mod_id == int(query))
+    if "[reason]" in fields:
+        checks.append(query.lower() in infraction.reason.lower())
+    return len(checks) == 0 or any(checks)
+
+SEARCH_BATCH = 100
+# plain words, anything else falls back to a substring scan
+FULLTEXT_TOKEN = re.compile(r"^\w+$")
+# fulltext index settings of the server, fetched on the first reason search
+FT_MIN_TOKEN = None
+FT_STOPWORDS = None
+# innodb defaults, in case the server won't tell us
+DEFAULT_MIN_TOKEN = 3
+DEFAULT_STOPWORDS = {"a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how", "i",
+                     "in", "is", "it", "la", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when",
+                     "where", "who", "will", "with", "und", "www"}
+
+
+async def search_infractions(guild_id, query, fields, amount):
+    """
+    every search field gets its own query that can use its own index, the results get merged afterwards
+    """
+    if query == "":
+        return await fetch_keyset(50, guild_id=guild_id)
+    searches = []
+    if "[user]" in fields and isinstance(query, int):
+        searches.append(fetch_keyset(amount, guild_id=guild_id, user_id=query))
+    if "[mod]" in fields and isinstance(query, int):
+        searches.append(fetch_keyset(amount, guild_id=guild_id, mod_id=query))
+    if "[reason]" in fields:
+        searches.append(search_reasons(guild_id, str(query), amount))
+    if len(searches) == 0:
+        return await fetch_keyset(amount, guild_id=guild_id)
+    found = {inf.id: inf for infs in await asyncio.gather(*searches) for inf in infs}
+    return sorted(found.values(), key=lambda inf: inf.id, reverse=True)[:amount]
+
+
+async def fetch_keyset(amount, **filters):
+    # walk down the ids in batches instead of asking for everything at once
+    infs = []
+    last = None
+    while len(infs) < amount:
+        query = Infraction.filter(**filters)
+        if last is not None:
+            query = query.filter(id__lt=last)
+        batch = await query.order_by("-id").limit(min(SEARCH_BATCH, amount - len(infs)))
+        infs.extend(batch)
+        if len(batch) < SEARCH_BATCH:
+            break
+        last = batch[-1].id
+    return infs
+
+
+async def fulltext_settings():
+    global FT_MIN_TOKEN, FT_STOPWORDS
+    if FT_MIN_TOKEN is None:
+        connection = Tortoise.get_connection("default")
+        try:
+            FT_MIN_TOKEN = (await connection.execute_query_dict("SELECT @@innodb_ft_min_token_size AS size"))[0]["size"]
+            FT_STOPWORDS = {row["value"] for row in await connection.execute_query_dict(
+                "SELECT value FROM INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD")}
+        except Exception as ex:
+            GearbotLogging.exception("Failed to fetch the fulltext settings, using the innodb defaults", ex)
+            FT_MIN_TOKEN = DEFAULT_MIN_TOKEN
+            FT_STOPWORDS = DEFAULT_STOPWORDS
+    return FT_MIN_TOKEN, FT_STOPWORDS
+
+
+async def search_reasons(guild_id, text, amount):
+    tokens = text.lower().split()
+    min_token, stopwords = await fulltext_settings()
+    # short words and stopwords are not in the index, requiring them would never match anything
+    if len(tokens) == 0 or not all(FULLTEXT_TOKEN.match(t) and len(t) >= min_token and t not in stopwords for t in tokens):
+        return await fetch_keyset(amount, guild_id=guild_id, reason__icontains=text)
+    # the fulltext index narrows it down to reasons with words starting with every term,
+    # then only keep the ones that really contain the text, same as a substring search would
+    # walked down by id in batches like fetch_keyset so common words don't pull in every row
+    terms = " ".join(f"+{t}*" for t in tokens)
+    lowered = text.lower()
+    connection = Tortoise.get_connection("default")
+    ids = []
+    last = None
+    while len(ids) < amount:
+        sql = "SELECT id, reason FROM infraction WHERE guild_id = %s AND MATCH(reason) AGAINST (%s IN BOOLEAN MODE)"
+        params = [guild_id, terms]
+        if last is not None:
+            sql += " AND id < %s"
+            params.append(last)
+        rows = await connection.execute_query_dict(f"{sql} ORDER BY id DESC LIMIT %s", [*params, SEARCH_BATCH])
+        ids.extend(row["id"] for row in rows if lowered in row["reason"].lower())
+        if len(rows) < SEARCH_BATCH:
+            break
+        last = rows[-1]["id"]
+    if len(ids) == 0:
+        return []
+    return await Infraction.filter(id__in=ids[:amount]).order_by("-id")
+
 
 async def fetch_infraction_pages(guild_id, query, amount, fields, requested):
     key = get_key(guild_id, query, fields, amount)
-    if query == "":
-        infs = await Infraction.filter(guild_id = guild_id).order_by("-id").limit(50)
-    else:
-        subfilters = []
-        if "[user]" in fields and isinstance(query, int):
-            subfilters.append(Q(user_id=query))
-        if "[mod]" in fields and isinstance(query, int):
-            subfilters.append(Q(mod_id=query))
-        if "[reason]" in fields:
-            subfilters.append(Q(reason__icontains=str(query)))
-
-        infs = await Infraction.filter(Q(Q(*subfilters, join_type="OR"), guild_id=guild_id, join_type="AND")).order_by("-id").limit(int(amount))
+    infs = await search_infractions(guild_id, query, fields, int(amount))
     longest_type = 4
     longest_id = len(str(infs[0].id)) if len(infs) > 0 else len(Translator.translate('id', guild_id))
     longest_timestamp = max(len(Translator.translate('timestamp', guild_id)), 19)
@@ -107,15 +237,16 @@ async def update_pages(guild_id, query, fields, amount, pages, start, longest_id
         order.append(lower)
         lower -= 1
     GearbotLogging.debug(f"Updating pages for {key}, ordering: {order}")
+    # resolve the names for all pages in one go
+    found = [set(ID_MATCHER.findall(page)) for page in pages]
+    names = await Utils.usernames([int(uid.strip()) for ids in found for uid in ids], clean=False)
     for number in order:
         longest_name = max(len(Translator.translate('moderator', guild_id)), len(Translator.translate('user', guild_id)))
         page = pages[number]
-        found = set(ID_MATCHER.findall(page))
-        for uid in found:
-            name = await Utils.username(int(uid.strip()), clean=False)
-            longest_name = max(longest_name, len(name))
-        for uid in found:
-            name = Utils.pad(await Utils.username(int(uid.strip()), clean=False), longest_name)
+        for uid in found[number]:
+            longest_name = max(longest_name, len(names[int(uid.strip())]))
+        for uid in found[number]:
+            name = Utils.pad(names[int(uid.strip())], longest_name)
             page = page.replace(f"<@{uid}>", name).replace(f"<@!{uid}>", name)
         page = f"{header}```md\n{get_header(longest_id, longest_name, longest_type, longest_timestamp, guild_id)}\n{page}```"
         GearbotLogging.debug(f"Finished assembling page {number} for key {key}")
@@ -198,23 +329,24 @@ async def inf_update(message, query, fields, amount, page_num):
     return parts
 
 
-async def inf_cleaner(guild_id, reset_cache=False):
+async def inf_cleaner(guild_id, reset_cache=False, infractions=None):
     pipeline = bot.redis_pool.pipeline()
     key = f"inf_track:{guild_id}"
     reactors = await bot.redis_pool.smembers(key)
     for reactor in reactors:
-        pipeline.hget(f"reactor:{reactor}", "channel_id")
-        pipeline.hget(f"reactor:{reactor}", "cache_key")
+        pipeline.hmget(f"reactor:{reactor}", "channel_id", "cache_key", "query", "fields")
     bits = await pipeline.execute()
     out = list()
+    stale = set()
     pipeline = bot.redis_pool.pipeline()
-    for i in range(len(reactors)):
-        target = i * 2
-        if bits[target] is None:
-            pipeline.srem(key, reactors[i])
+    for reactor, (channel_id, cache_key, query, fields) in zip(reactors, bits):
+        if channel_id is None:
+            pipeline.srem(key, reactor)
         else:
-            out.append((reactors[i], int(bits[target])))
-        if reset_cache and bits[target + 1] is not None:
-            pipeline.unlink(bits[target + 1])
+            out.append((reactor, int(channel_id)))
+        if reset_cache and cache_key is not None and cache_key not in stale:
+            if infractions is None or any(could_match(query, fields, inf) for inf in infractions):
+                stale.add(cache_key)
+                pipeline.unlink(cache_key)
     bot.loop.create_task(pipeline.execute())
     return out
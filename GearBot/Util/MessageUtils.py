@@ -1,11 +1,12 @@
 import collections
+import struct
 import time
 from collections import namedtuple
 from datetime import datetime
 
 from discord import Object, HTTPException, MessageType, AllowedMentions
 
-from Util import Translator, Emoji, Archive, GearbotLogging
+from Util import Translator, Emoji, Archive, GearbotLogging, Utils
 from database import DBUtils
 from database.DatabaseConnector import LoggedMessage
 
@@ -17,16 +18,115 @@ def is_cache_enabled(bot):
 
 attachment = namedtuple("attachment", "id name")
 
+# cached messages are stored as a single packed string instead of a hash:
+# header (version, author, channel, server, type, pinned, attachment count),
+# then every attachment (id, name length, name) and finally the content, all text in utf-8
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct(">BQQQBBH")
+CACHE_ATTACHMENT = struct.Struct(">QH")
+NO_TYPE = 255
+CACHE_TTL = 5 * 60 + 2
+
+
+def encode_message(author, channel, server, message_type, pinned, attachments, content):
+    parts = [CACHE_HEADER.pack(CACHE_VERSION, author, channel, server, NO_TYPE if message_type is None else message_type,
+                               1 if pinned else 0, len(attachments))]
+    for aid, name in attachments:
+        name = name.encode()
+        parts.append(CACHE_ATTACHMENT.pack(int(aid), len(name)))
+        parts.append(name)
+    parts.append(content.encode())
+    return b"".join(parts)
+
+
+def decode_message(message_id, data):
+    if data[0] != CACHE_VERSION:
+        return None
+    _, author, channel, server, message_type, pinned, count = CACHE_HEADER.unpack_from(data)
+    offset = CACHE_HEADER.size
+    attachments = []
+    for _ in range(count):
+        aid, length = CACHE_ATTACHMENT.unpack_from(data, offset)
+        offset += CACHE_ATTACHMENT.size
+        attachments.append(attachment(aid, data[offset:offset + length].decode()))
+        offset += length
+    return Message(message_id, author, data[offset:].decode(), channel, server, attachments,
+                   type=None if message_type == NO_TYPE else message_type, pinned=pinned == 1)
+
+
+def decode_legacy_message(message_id, parts):
+    # pre-packing hash format, only around for the 5 minutes after an upgrade until those expire
+    if len(parts) < 6:
+        return None
+    return Message(message_id, int(parts["author"]), parts["content"], int(parts["channel"]), int(parts["server"]), [attachment(*a.split("/", 1)) for a in parts["attachments"].split("|")] if len(parts["attachments"]) > 0 else [], type=int(parts["type"]) if "type" in parts else None, pinned=parts["pinned"] == '1')
+
+
+def pending_message(message_id):
+    # still waiting in the write buffer, this is the only place to find it if redis is unavailable
+    pending = DBUtils.get_pending(message_id)
+    if pending is None:
+        return None
+    m, attachments = pending
+    return Message(message_id, m["author"], m["content"], m["channel"], m["server"], [attachment(a["id"], a["name"]) for a in attachments],
+                   type=m["type"], pinned=m["pinned"])
+
+
+def in_cache_window(message_id):
+    return not Object(message_id).created_at <= datetime.utcfromtimestamp(time.time() - 5 * 60)
+
+
 async def get_message_data(bot, message_id):
     message = None
-    if is_cache_enabled(bot) and not Object(message_id).created_at <= datetime.utcfromtimestamp(time.time() - 5 * 60):
-        parts = await bot.redis_pool.hgetall(f"messages:{message_id}")
-        if len(parts) is 6:
-            message = Message(message_id, int(parts["author"]), parts["content"], int(parts["channel"]), int(parts["server"]), [attachment(a.split("/")[0], a.split("/")[1]) for a in parts["attachments"].split("|")] if len(parts["attachments"]) > 0 else [], type=int(parts["type"]) if "type" in parts else None, pinned=parts["pinned"] == '1')
+    if is_cache_enabled(bot) and in_cache_window(message_id):
+        pipe = bot.redis_pool.pipeline()
+        pipe.get(f"message:{message_id}", encoding=None)
+        pipe.hgetall(f"messages:{message_id}")
+        data, legacy = await pipe.execute()
+        if data is not None:
+            message = decode_message(message_id, data)
+        elif len(legacy) > 0:
+            message = decode_legacy_message(message_id, legacy)
+    if message is None:
+        message = pending_message(message_id)
     if message is None:
         message = await LoggedMessage.get_or_none(messageid = message_id).prefetch_related("attachments")
     return message
 
+async def get_messages_bulk(bot, message_ids):
+    """
+    get_message_data for a whole batch of messages: one redis pipeline for everything still in the cache window
+    and chunked database queries for the rest
+    """
+    messages = dict()
+    todo = list(message_ids)
+    if is_cache_enabled(bot):
+        recent = [mid for mid in todo if in_cache_window(mid)]
+        if len(recent) > 0:
+            pipe = bot.redis_pool.pipeline()
+            for mid in recent:
+                pipe.get(f"message:{mid}", encoding=None)
+                pipe.hgetall(f"messages:{mid}")
+            results = await pipe.execute()
+            for i, mid in enumerate(recent):
+                data, legacy = results[i * 2], results[i * 2 + 1]
+                message = None
+                if data is not None:
+                    message = decode_message(mid, data)
+                elif len(legacy) > 0:
+                    message = decode_legacy_message(mid, legacy)
+                if message is not None:
+                    messages[mid] = message
+            todo = [mid for mid in todo if mid not in messages]
+    for mid in todo:
+        message = pending_message(mid)
+        if message is not None:
+            messages[mid] = message
+    todo = [mid for mid in todo if mid not in messages]
+    for chunk in Utils.chunks(todo, 1000):
+        for message in await LoggedMessage.filter(messageid__in=chunk).prefetch_related("attachments"):
+            messages[message.messageid] = message
+    return messages
+
 async def insert_message(bot, message, redis=True):
     message_type = message.type
     if message_type == MessageType.default:
@@ -35,21 +135,29 @@ async def insert_message(bot, message, redis=True):
         if not isinstance(message_type, int):
             message_type = message_type.value
     if redis and is_cache_enabled(bot):
-        pipe = bot.redis_pool.pipeline()
-        pipe.hmset_dict(f"messages:{message.id}", author=message.author.id, content=message.content,
-                         channel=message.channel.id, server=message.guild.id, pinned=1 if message.pinned else 0, attachments='|'.join((f"{str(a.id)}/{str(a.filename)}" for a in message.attachments)))
-        if message_type is not None:
-            pipe.hmset_dict(f"messages:{message.id}", type=message_type)
-        pipe.expire(f"messages:{message.id}", 5*60+2)
-        await pipe.execute()
-    await DBUtils.insert_message(message)
+        data = encode_message(message.author.id, message.channel.id, message.guild.id, message_type, message.pinned,
+                              [(a.id, a.filename) for a in message.attachments], message.content)
+        await bot.redis_pool.set(f"message:{message.id}", data, expire=CACHE_TTL)
+    await DBUtils.queue_message(message)
 
 async def update_message(bot, message_id, content, pinned):
-    if is_cache_enabled(bot) and not Object(message_id).created_at <= datetime.utcfromtimestamp(time.time() - 5 * 60):
+    if is_cache_enabled(bot) and in_cache_window(message_id):
+        key = f"message:{message_id}"
         pipe = bot.redis_pool.pipeline()
-        pipe.hmset_dict(f"messages:{message_id}", content=content)
-        pipe.hmset_dict(f"messages:{message_id}", pinned=(1 if pinned else 0))
-        await pipe.execute()
+        pipe.get(key, encoding=None)
+        pipe.pttl(key)
+        data, ttl = await pipe.execute()
+        if data is not None and ttl > 0:
+            old = decode_message(message_id, data)
+            if old is not None:
+                data = encode_message(old.author, old.channel, old.server, old.type, pinned, old.attachments, content)
+                await bot.redis_pool.set(key, data, pexpire=ttl)
+        elif await bot.redis_pool.exists(f"messages:{message_id}"):
+            pipe = bot.redis_pool.pipeline()
+            pipe.hmset_dict(f"messages:{message_id}", content=content)
+            pipe.hmset_dict(f"messages:{message_id}", pinned=(1 if pinned else 0))
+            await pipe.execute()
+    DBUtils.update_pending(message_id, content, pinned)
     await LoggedMessage.filter(messageid=message_id).update(content=content, pinned=pinned)
 
 def assemble(destination, emoji, m, translate=True, **kwargs):
@@ -57,11 +165,7 @@ def assemble(destination, emoji, m, translate=True, **kwargs):
     return f"{Emoji.get_chat_emoji(emoji)} {translated}"
 
 async def archive_purge(bot, id_list, guild_id):
-    message_list = dict()
-    for mid in id_list:
-        message = await get_message_data(bot, mid)
-        if message is not None:
-            message_list[mid] = message
+    message_list = await get_messages_bulk(bot, id_list)
     if len(message_list) > 0:
         await Archive.archive_purge(bot, guild_id,
                                     collections.OrderedDict(sorted(message_list.items())))
@@ -1,8 +1,23 @@
+from collections import OrderedDict, namedtuple
+
 from discord.ext import commands
 from discord.ext.commands import NoPrivateMessage, BotMissingPermissions, CheckFailure
 
 from Util import Configuration
 
+PERM_TYPES = ["LVL4", "ADMIN", "MOD", "TRUSTED"]
+# guild id -> perm type -> (role ids, user ids)
+PERM_SETS = dict()
+# (guild id, member id) -> (role ids, guild generation, level), least recently used first
+LEVELS = OrderedDict()
+MAX_LEVELS = 10000
+# bumped to throw out all cached levels of a guild at once
+GENERATIONS = dict()
+# guild id (None for DMs) -> qualified command name -> CommandPerms, filled as commands get used
+COMMAND_PERMS = dict()
+
+CommandPerms = namedtuple("CommandPerms", "required people")
+
 
 def is_owner():
     async def predicate(ctx):
@@ -37,16 +52,28 @@ def is_user(perm_type, member):
     if not hasattr(member, "roles"):
         return False
 
-    roles = Configuration.get_var(member.guild.id, "PERMISSIONS", f"{perm_type}_ROLES")
-    users = Configuration.get_var(member.guild.id, "PERMISSIONS", f"{perm_type}_USERS")
+    roles, users = get_perm_sets(member.guild.id)[perm_type]
+    return member.id in users or not roles.isdisjoint(member._roles)
 
-    if member.id in users:
-        return True
 
-    for role in member.roles:
-        if role.id in roles:
-            return True
-    return False
+def get_perm_sets(guild_id):
+    if guild_id not in PERM_SETS:
+        PERM_SETS[guild_id] = {
+            perm_type: (frozenset(Configuration.get_var(guild_id, "PERMISSIONS", f"{perm_type}_ROLES")),
+                        frozenset(Configuration.get_var(guild_id, "PERMISSIONS", f"{perm_type}_USERS")))
+            for perm_type in PERM_TYPES
+        }
+    return PERM_SETS[guild_id]
+
+
+def invalidate_guild(guild_id):
+    PERM_SETS.pop(guild_id, None)
+    COMMAND_PERMS.pop(guild_id, None)
+    GENERATIONS[guild_id] = GENERATIONS.get(guild_id, 0) + 1
+
+
+def invalidate_member(guild_id, member_id):
+    LEVELS.pop((guild_id, member_id), None)
 
 
 def mod_only():
@@ -79,16 +106,41 @@ def require_cache():
 
 def check_permission(command_object, guild, member):
     if guild is None:
-        return 0 >= get_required(command_object, command_object.cog.permissions)
+        return 0 >= get_command_perms(None, command_object).required
     else:
-        overrides = Configuration.get_var(guild.id, "PERM_OVERRIDES")
+        return get_user_lvl(guild, member, command_object) >= get_command_perms(guild.id, command_object).required
+
+
+def get_command_perms(guild_id, command_object):
+    perms = COMMAND_PERMS.setdefault(guild_id, dict())
+    name = command_object.qualified_name
+    if name not in perms:
+        perms[name] = compile_command_perms(guild_id, command_object)
+    return perms[name]
+
+
+def compile_command_perms(guild_id, command_object):
+    """
+    resolves the required level and override people for a command once, so the permission trees
+    don't need to be walked on every check
+    """
+    required = -1
+    people = set()
+    if guild_id is not None:
+        overrides = Configuration.get_var(guild_id, "PERM_OVERRIDES")
         cog_name = type(command_object.cog).__name__
-        required = -1
         if cog_name in overrides:
             required = get_required(command_object, overrides[cog_name])
-        if required == -1:
-            required = get_required(command_object, command_object.cog.permissions)
-        return get_user_lvl(guild, member, command_object) >= (command_object.cog.permissions["required"] if required == -1 else required)
+            target = overrides[cog_name]
+            pieces = get_command_pieces(command_object)
+            while len(pieces) > 0 and "commands" in target and pieces[0] in target["commands"]:
+                target = target["commands"][pieces.pop(0)]
+                people.update(target["people"])
+    if required == -1:
+        required = get_required(command_object, command_object.cog.permissions)
+    if required == -1:
+        required = command_object.cog.permissions["required"]
+    return CommandPerms(required, frozenset(people))
 
 
 def get_command_pieces(command_object):
@@ -131,34 +183,41 @@ def get_perm_dict(pieces, perm_dict, strict=False):
 
 
 def get_user_lvl(guild, member, command_object=None):
-    if guild.owner is not None and guild.owner.id == member.id:
-        return 5
+    lvl = cached_lvl(guild, member)
+    if lvl >= 4:
+        return lvl
 
-    if is_lvl4(member):
+    if command_object is not None and member.id in get_command_perms(guild.id, command_object).people:
         return 4
-
-    if command_object is not None:
-        cog_name = type(command_object.cog).__name__
-        overrides = Configuration.get_var(guild.id, "PERM_OVERRIDES")
-        if cog_name in overrides:
-            target = overrides[cog_name]
-            pieces = get_command_pieces(command_object)
-            while len(pieces) > 0 and "commands" in target and pieces[0] in target["commands"]:
-                target = target["commands"][pieces.pop(0)]
-                if member.id in target["people"]:
-                    return 4
-    if is_admin(member):
-        return 3
-    if is_mod(member):
-        return 2
-    if is_trusted(member):
-        return 1
-    return 0
+    return lvl
 
 
 def user_lvl(member):
-    if member.guild.owner.id == member.id:
+    return cached_lvl(member.guild, member)
+
+
+def cached_lvl(guild, member):
+    # ownership can change without any role changes, not worth caching anyways
+    if guild.owner is not None and guild.owner.id == member.id:
         return 5
+    if not hasattr(member, "roles"):
+        return compute_lvl(member)
+    key = (guild.id, member.id)
+    roles = tuple(member._roles)
+    generation = GENERATIONS.get(guild.id, 0)
+    entry = LEVELS.get(key)
+    if entry is not None and entry[0] == roles and entry[1] == generation:
+        LEVELS.move_to_end(key)
+        return entry[2]
+    lvl = compute_lvl(member)
+    LEVELS[key] = (roles, generation, lvl)
+    LEVELS.move_to_end(key)
+    if len(LEVELS) > MAX_LEVELS:
+        LEVELS.popitem(last=False)
+    return lvl
+
+
+def compute_lvl(member):
     if is_lvl4(member):
         return 4
     if is_admin(member):
@@ -27,6 +27,14 @@ class PromMonitors:
 
         self.bot_event_counts = prom.Counter("bot_event_counts", "How much each event occurred", ["event_name"])
 
+        self.invite_cache_lookups = prom.Counter("invite_cache_lookups", "Invite resolution cache lookups by result", ["result"])
+
+        self.log_queue_depth = prom.Gauge("log_queue_depth", "How many log messages are waiting to be sent")
+        self.log_send_latency = prom.Histogram("log_send_latency", "How long sending out a batch of log messages takes")
+
+        self.config_saves = prom.Counter("config_saves", "Guild config saves by outcome", ["result"])
+        self.config_save_latency = prom.Histogram("config_save_latency", "How long writing out a guild config takes")
+
         self.bot_latency = prom.Gauge("bot_latency", "Current bot latency")
         self.bot_latency.set_function(lambda : bot.latency)
 
@@ -39,4 +47,9 @@ class PromMonitors:
         bot.metrics_reg.register(self.bot_users_unique)
         bot.metrics_reg.register(self.bot_event_counts)
         bot.metrics_reg.register(self.own_message_raw_count)
-        bot.metrics_reg.register(self.bot_latency)
\ No newline at end of file
+        bot.metrics_reg.register(self.bot_latency)
+        bot.metrics_reg.register(self.invite_cache_lookups)
+        bot.metrics_reg.register(self.log_queue_depth)
+        bot.metrics_reg.register(self.log_send_latency)
+        bot.metrics_reg.register(self.config_saves)
+        bot.metrics_reg.register(self.config_save_latency)
\ No newline at end of file
@@ -0,0 +1,75 @@
+import asyncio
+import heapq
+import time
+
+from Util import GearbotLogging
+
+
+class Scheduler:
+    """
+    keeps upcoming jobs in a heap and sleeps until the first one is due, instead of polling for them
+    jobs are identified by a key, scheduling a key again moves it to the new time
+    """
+
+    def __init__(self, name, handler):
+        self.name = name
+        self.handler = handler
+        self.heap = []
+        self.due = dict()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def schedule(self, key, due):
+        if self.due.get(key) == due:
+            return
+        self.due[key] = due
+        heapq.heappush(self.heap, (due, key))
+        # new first job, wake up so we don't oversleep it
+        if self.heap[0][1] == key:
+            self.wakeup.set()
+
+    def cancel(self, key):
+        # the heap entry stays behind but gets skipped once it comes up
+        self.due.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.due
+
+    def __len__(self):
+        return len(self.due)
+
+    async def _run(self):
+        GearbotLogging.info(f"Started {self.name} scheduler")
+        try:
+            while True:
+                now = time.time()
+                while len(self.heap) > 0 and self.heap[0][0] <= now:
+                    due, key = heapq.heappop(self.heap)
+                    # outdated entry, it got moved or canceled
+                    if self.due.get(key) != due:
+                        continue
+                    del self.due[key]
+                    asyncio.ensure_future(self._fire(key))
+                self.wakeup.clear()
+                timeout = self.heap[0][0] - now if len(self.heap) > 0 else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            GearbotLogging.info(f"{self.name} scheduler terminated")
+
+    async def _fire(self, key):
+        try:
+            await self.handler(key)
+        except Exception as ex:
+            GearbotLogging.exception(f"{self.name} scheduler failed to handle {key}", ex)
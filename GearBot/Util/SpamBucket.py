@@ -1,58 +1,284 @@
+import asyncio
 import time
+from collections import namedtuple, OrderedDict, deque
+
+from aioredis.errors import ReplyError, RedisError
+
+from Util import GearbotLogging
 
 
 def ms_time():
     return int(time.time() * 1000)
 
 
-class SpamBucket:
+# expire, insert, refresh the ttl and read back every bucket in a single round trip
+# KEYS = bucket keys
+# ARGV = per key: current time (ms), period (s), amount to insert, message identifier
+BUCKET_SCRIPT = """
+local out = {}
+for k = 1, #KEYS do
+    local key = KEYS[k]
+    local base = (k - 1) * 4
+    local now = tonumber(ARGV[base + 1])
+    local period = tonumber(ARGV[base + 2])
+    local amount = tonumber(ARGV[base + 3])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - (period * 1000))
+    for i = 0, amount - 1 do
+        redis.call('ZADD', key, now, ARGV[base + 4] .. '-' .. i)
+    end
+    redis.call('EXPIRE', key, period)
+    out[k] = redis.call('ZRANGEBYSCORE', key, '-inf', '+inf', 'WITHSCORES')
+end
+return out
+"""
+
+SCRIPT_SHA = None
+
+BucketState = namedtuple("BucketState", "count span members")
+BucketOp = namedtuple("BucketOp", "key current_time period amount message")
+
+
+async def initialize(redis):
+    # cache the script server side so buckets only need to send the digest
+    global SCRIPT_SHA
+    SCRIPT_SHA = await redis.script_load(BUCKET_SCRIPT)
 
-    def __init__(self, redis, key_format, max_actions, period, extra_actions):
+
+def to_state(members, scores):
+    span = scores[-1] - scores[0] if len(scores) > 1 else 0
+    return BucketState(len(members), span, members)
+
+
+class RedisEngine:
+
+    def __init__(self, redis):
         self.redis = redis
+
+    async def run(self, key, current_time, period, amount, message):
+        return (await self.run_many([BucketOp(key, current_time, period, amount, message)]))[0]
+
+    async def run_many(self, ops):
+        if len(ops) == 0:
+            return []
+        if SCRIPT_SHA is None:
+            await initialize(self.redis)
+        keys = [op.key for op in ops]
+        args = [arg for op in ops for arg in (op.current_time, op.period, op.amount, op.message)]
+        try:
+            raw = await self.redis.evalsha(SCRIPT_SHA, keys=keys, args=args)
+        except ReplyError as ex:
+            # redis got restarted or flushed its script cache, load it again
+            if not str(ex).startswith("NOSCRIPT"):
+                raise ex
+            await initialize(self.redis)
+            raw = await self.redis.evalsha(SCRIPT_SHA, keys=keys, args=args)
+        return [to_state(r[0::2], [float(s) for s in r[1::2]]) for r in raw]
+
+    async def state(self, key, current_time, period, expire=True):
+        pipe = self.redis.pipeline()
+        if expire:
+            pipe.zremrangebyscore(key, max=(current_time - (period * 1000)))
+        pipe.zrangebyscore(key, withscores=True)
+        entries = (await pipe.execute())[-1]
+        return to_state([m for m, _ in entries], [s for _, s in entries])
+
+    async def clear(self, key):
+        await self.redis.zremrangebyscore(key)
+
+    async def push(self, buckets):
+        pipe = self.redis.pipeline()
+        for key, (period, entries) in buckets.items():
+            for score, member in entries:
+                pipe.zadd(key, score, member)
+            pipe.expire(key, period)
+        await pipe.execute()
+
+
+class MemoryEngine:
+    """
+    in process fallback for when redis is unavailable, timestamps are kept in a bounded deque per key
+    and keys are evicted once they went idle for longer then their period or when we go over the key limit
+    """
+
+    def __init__(self, max_keys=50000, max_entries=500):
+        self.max_keys = max_keys
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.last_sweep = ms_time()
+
+    def _expire(self, key, current_time, period):
+        if key not in self.buckets:
+            return None
+        _, entries = self.buckets[key]
+        limit = current_time - (period * 1000)
+        while len(entries) > 0 and entries[0][0] <= limit:
+            entries.popleft()
+        return entries
+
+    def _sweep(self):
+        now = ms_time()
+        if now - self.last_sweep < 60000:
+            return
+        self.last_sweep = now
+        for key in [k for k, (period, entries) in self.buckets.items() if
+                    len(entries) == 0 or entries[-1][0] + period * 1000 < now]:
+            del self.buckets[key]
+
+    async def run(self, key, current_time, period, amount, message):
+        self._sweep()
+        entries = self._expire(key, current_time, period)
+        if entries is None:
+            entries = deque(maxlen=self.max_entries)
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+        self.buckets[key] = (period, entries)
+        self.buckets.move_to_end(key)
+        for i in range(0, amount):
+            entries.append((current_time, f"{message}-{i}"))
+        return await self.state(key, current_time, period, expire=False)
+
+    async def run_many(self, ops):
+        return [await self.run(*op) for op in ops]
+
+    async def state(self, key, current_time, period, expire=True):
+        entries = self._expire(key, current_time, period) if expire else self.buckets.get(key, (0, []))[1]
+        if entries is None:
+            return BucketState(0, 0, [])
+        return to_state([m for _, m in entries], [s for s, _ in entries])
+
+    async def clear(self, key):
+        if key in self.buckets:
+            del self.buckets[key]
+
+    def drain(self):
+        now = ms_time()
+        buckets = {k: (period, entries) for k, (period, entries) in self.buckets.items() if
+                   len(entries) > 0 and entries[-1][0] + period * 1000 >= now}
+        self.buckets = OrderedDict()
+        return buckets
+
+
+class FailoverEngine:
+    """
+    routes bucket operations to redis, falls back to the in memory engine when redis is missing,
+    erroring or too slow and pushes the memory state back to redis once it recovered
+    """
+    ERROR_THRESHOLD = 3
+    LATENCY_THRESHOLD = 0.25
+    PROBE_INTERVAL = 30
+    # hard limit for a single redis call, a connection that hangs without closing would block anti-spam otherwise
+    CALL_TIMEOUT = 1
+    # connection drops come in as RedisError subclasses, refused connections as OSError
+    REDIS_ERRORS = (RedisError, OSError, asyncio.TimeoutError)
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.memory = MemoryEngine()
+        self.degraded = False
+        self.errors = 0
+        self.latency = 0
+        self.probe_task = None
+
+    def _engine(self):
+        if self.bot.redis_pool is None or self.degraded:
+            return self.memory
+        return RedisEngine(self.bot.redis_pool)
+
+    async def _call(self, name, *args, **kwargs):
+        engine = self._engine()
+        if engine is self.memory:
+            return await getattr(engine, name)(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(getattr(engine, name)(*args, **kwargs), self.CALL_TIMEOUT)
+        except self.REDIS_ERRORS as ex:
+            self.errors += 1
+            if self.errors >= self.ERROR_THRESHOLD:
+                self._degrade(f"{self.errors} consecutive errors, last one: {type(ex).__name__} {ex}")
+            return await getattr(self.memory, name)(*args, **kwargs)
+        # moving average so a single slow call doesn't flip us over
+        self.errors = 0
+        self.latency = self.latency * 0.9 + (time.perf_counter() - start) * 0.1
+        if self.latency > self.LATENCY_THRESHOLD:
+            self._degrade(f"average latency of {round(self.latency * 1000)}ms")
+        return result
+
+    def _degrade(self, reason):
+        if self.degraded:
+            return
+        self.degraded = True
+        GearbotLogging.warn(f"Redis spam buckets degraded ({reason}), switching to in memory buckets")
+        self.probe_task = self.bot.loop.create_task(self._probe())
+
+    async def _probe(self):
+        while self.degraded:
+            await asyncio.sleep(self.PROBE_INTERVAL)
+            if self.bot.redis_pool is None:
+                continue
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.bot.redis_pool.ping(), self.CALL_TIMEOUT)
+            except self.REDIS_ERRORS:
+                continue
+            if time.perf_counter() - start > self.LATENCY_THRESHOLD:
+                continue
+            try:
+                await asyncio.wait_for(RedisEngine(self.bot.redis_pool).push(self.memory.drain()), self.CALL_TIMEOUT)
+            except self.REDIS_ERRORS:
+                continue
+            self.errors = 0
+            self.latency = 0
+            self.degraded = False
+            GearbotLogging.info("Redis spam buckets recovered, in memory buckets have been synced back")
+        self.probe_task = None
+
+    async def run(self, key, current_time, period, amount, message):
+        return await self._call("run", key, current_time, period, amount, message)
+
+    async def run_many(self, ops):
+        return await self._call("run_many", ops)
+
+    async def state(self, key, current_time, period, expire=True):
+        return await self._call("state", key, current_time, period, expire)
+
+    async def clear(self, key):
+        return await self._call("clear", key)
+
+
+class SpamBucket:
+
+    def __init__(self, engine, key_format, max_actions, period, extra_actions):
+        self.engine = engine
         self.key_format = key_format
         self.max_actions = max_actions
         self.period = period
         self.extra_actions = extra_actions
 
     async def incr(self, key, current_time, message, amt=1, expire=True):
-        if expire:
-            await self._remove_expired_keys(key, current_time)
-        k = self.key_format.format(key)
-        for i in range(0, amt):
-            await self.redis.zadd(k, current_time, f"{message}-{i}")
-        await self.redis.expire(k, self.period)
-        return await self.redis.zcount(k)
+        # expiring is part of the script, nothing gets inserted that isn't valid anymore by the time we read it back
+        return (await self.engine.run(self.key_format.format(key), current_time, self.period, amt, message)).count
+
+    def op(self, key, current_time, amount, message):
+        """
+        bucket operation to hand to the engine's run_many, for batching checks of multiple buckets together
+        """
+        return BucketOp(self.key_format.format(key), current_time, self.period, amount, message)
 
     async def check(self, key, current_time, message, amount=1, expire=True):
-        if expire:
-            await self._remove_expired_keys(key, current_time)
         amt = await self.incr(key, current_time, amount, message)
-        return amt >= (self.max_actions + self.extra_actions.count)
+        return self.is_triggered(amt)
+
+    def is_triggered(self, count):
+        return count >= (self.max_actions + self.extra_actions.count)
 
     async def count(self, key, current_time, expire=True):
-        if expire:
-            await self._remove_expired_keys(key, current_time)
-        k = self.key_format.format(key)
-        return await self.redis.zcount(k)
+        return (await self.engine.state(self.key_format.format(key), current_time, self.period, expire)).count
 
     async def get(self, key, current_time, expire=True):
-        if expire:
-            await self._remove_expired_keys(key, current_time)
-        k = self.key_format.format(key)
-        return await self.redis.zrangebyscore(k)
+        return (await self.engine.state(self.key_format.format(key), current_time, self.period, expire)).members
 
     async def size(self, key, current_time, expire=True):
-        if expire:
-            await self._remove_expired_keys(key, current_time)
-        k = self.key_format.format(key)
-        values = await self.redis.zrangebyscore(k)
-        if len(values) <= 1:
-            return 0
-        return (await self.redis.zscore(k, values[-1])) - (await self.redis.zscore(k, values[0]))
+        return (await self.engine.state(self.key_format.format(key), current_time, self.period, expire)).span
 
     async def clear(self, key):
-        k = self.key_format.format(key)
-        await self.redis.zremrangebyscore(k)
-
-    async def _remove_expired_keys(self, key, current_time):
-        await self.redis.zremrangebyscore(self.key_format.format(key), max=(current_time - (self.period * 1000)))
+        await self.engine.clear(self.key_format.format(key))
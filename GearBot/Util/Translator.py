@@ -1,31 +1,71 @@
 import asyncio
 import hashlib
 import json
+import os
 import threading
 
 import urllib.parse
 import requests
 from parsimonious import ParseError, VisitationError
-from pyseeyou import format
+from pyseeyou.grammar import ICUMessageFormat
+from pyseeyou.node_visitor import ICUNodeVisitor
 
 from Util import Configuration, GearbotLogging, Emoji, Utils
 
 LANGS = dict()
+# parsed translation strings per language, parsing is by far the most expensive part of formatting
+TEMPLATES = dict()
 LANG_NAMES = dict(en_US= "English")
 LANG_CODES = dict(English="en_US")
 BOT = None
+refresher = None
 untranlatable = {"Sets a playing/streaming/listening/watching status", "Reloads all server configs from disk", "Reset the cache", "Make a role pingable for announcements", "Pulls from github so an upgrade can be performed without full restart", ''}
 
 async def initialize(bot_in):
-    global BOT
+    global BOT, refresher
     BOT = bot_in
-    await load_codes()
-    await update_all()
-    for lang in LANG_CODES.values():
+    # start with whatever we have on disk, english is always needed so load that one right away
+    # the rest gets loaded on first use
+    for lang in Utils.fetch_from_disk("lang/langs", []):
+        LANG_NAMES[lang["code"]] = lang["name"]
+        LANG_CODES[lang["name"]] = lang["code"]
+    for lang in list(LANGS.keys()):
         load_translations(lang)
+    load_translations("en_US")
+    # fresh copies get pulled in the background and swapped in as they arrive
+    if refresher is None or refresher.done():
+        refresher = BOT.loop.create_task(refresh())
+
+
+async def refresh():
+    try:
+        await load_codes()
+        await update_all()
+    except Exception as ex:
+        GearbotLogging.exception("Failed to refresh translations, running with the ones on disk", ex)
+
 
 def load_translations(lang):
     LANGS[lang] = Utils.fetch_from_disk(f"lang/{lang}")
+    TEMPLATES.pop(lang, None)
+
+
+def get_lang(lang):
+    if lang not in LANGS:
+        load_translations(lang)
+    return LANGS[lang]
+
+
+def get_template(lang, key):
+    templates = TEMPLATES.setdefault(lang, dict())
+    if key not in templates:
+        templates[key] = ICUMessageFormat.parse(get_lang(lang)[key])
+    return templates[key]
+
+
+def format(lang, key, kwargs):
+    return ICUNodeVisitor(kwargs, lang).visit(get_template(lang, key))
+
 
 def translate(key, location, **kwargs):
     lid = None
@@ -42,19 +82,20 @@ def translate(key, location, **kwargs):
     else:
         lang_key = Configuration.get_var(lid, "GENERAL", "LANG")
     translated = key
-    if key not in LANGS[lang_key]:
+    strings = get_lang(lang_key)
+    if key not in strings:
         if key not in untranlatable:
             BOT.loop.create_task(tranlator_log('WARNING', f'Untranslatable string detected in {lang_key}: {key}\n'))
             untranlatable.add(key)
-        return key if key not in LANGS["en_US"] else format(LANGS['en_US'][key], kwargs, 'en_US')
+        return key if key not in LANGS["en_US"] else format('en_US', key, kwargs)
     try:
-        translated = format(LANGS[lang_key][key], kwargs, lang_key)
+        translated = format(lang_key, key, kwargs)
     except (KeyError, ValueError, ParseError, VisitationError) as ex:
-        BOT.loop.create_task(tranlator_log('NO', f'Corrupt translation detected!\n**Lang code:** {lang_key}\n**Translation key:** {key}\n```\n{LANGS[lang_key][key]}```'))
+        BOT.loop.create_task(tranlator_log('NO', f'Corrupt translation detected!\n**Lang code:** {lang_key}\n**Translation key:** {key}\n```\n{strings[key]}```'))
         GearbotLogging.exception("Corrupt translation", ex)
         if key in LANGS["en_US"].keys():
             try:
-                translated = format(LANGS['en_US'][key], kwargs, 'en_US')
+                translated = format('en_US', key, kwargs)
             except (KeyError, ValueError, ParseError, VisitationError) as ex:
                 BOT.loop.create_task(tranlator_log('NO', f'Corrupt English source string detected!\n**Translation key:** {key}\n```\n{LANGS["en_US"][key]}```'))
                 GearbotLogging.exception('Corrupt translation', ex)
@@ -62,9 +103,9 @@ def translate(key, location, **kwargs):
 
 
 def translate_by_code(key, code, **kwargs):
-    if key not in LANGS[code]:
+    if key not in get_lang(code):
         return key
-    return format(LANGS[code][key], kwargs, code)
+    return format(code, key, kwargs)
 
 
 async def upload():
@@ -111,31 +152,57 @@ async def load_codes():
         Utils.save_to_disk("lang/langs", l)
 
 async def update_all():
-    futures = [update_lang(lang) for lang in LANG_CODES.values() if lang != "en_US"]
-    for chunk in Utils.chunks(futures, 20):
-        await asyncio.gather(*chunk)
+    # one shared dict for all languages, written once everything is done
+    versions = Configuration.get_persistent_var("lang_versions", dict())
+    futures = [update_lang(lang, versions=versions) for lang in LANG_CODES.values() if lang != "en_US"]
+    try:
+        for chunk in Utils.chunks(futures, 20):
+            await asyncio.gather(*chunk)
+    finally:
+        Configuration.set_persistent_var("lang_versions", versions)
 
 
-async def update_lang(lang, retry=True):
+async def update_lang(lang, retry=True, versions=None):
     t_info = Configuration.get_master_var("TRANSLATIONS")
     if t_info["SOURCE"] == "DISABLED": return
     if t_info["SOURCE"] == "CROWDIN":
         download_link = f"https://api.crowdin.com/api/project/gearbot/export-file?login={t_info['LOGIN']}&account-key={t_info['KEY']}&json&file={urllib.parse.quote('/bot/commands.json', safe='')}&language={lang}"
     else:
         download_link = f"https://gearbot.rocks/lang/{lang}.json"
+    # only ask for the file if it changed since the copy we have on disk
+    save = versions is None
+    if save:
+        versions = Configuration.get_persistent_var("lang_versions", dict())
+    headers = dict()
+    if lang in versions and os.path.isfile(f"lang/{lang}.json"):
+        etag, modified = versions[lang]
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if modified is not None:
+            headers["If-Modified-Since"] = modified
     GearbotLogging.info(f"Updating {lang} ({LANG_NAMES[lang]}) file...")
-    async with BOT.aiosession.get(download_link) as response:
+    async with BOT.aiosession.get(download_link, headers=headers) as response:
+        if response.status == 304:
+            GearbotLogging.info(f"{lang} ({LANG_NAMES[lang]}) is already up to date")
+            return
         content = await response.text()
         content = json.loads(content)
         if "success" in content:
             if retry:
                 GearbotLogging.warn(f"Failed to update {lang} ({LANG_NAMES[lang]}), trying again in 3 seconds")
                 await asyncio.sleep(3)
-                await update_lang(lang, False)
+                await update_lang(lang, False, None if save else versions)
             else:
                 await tranlator_log('NO', f"Failed to update {lang} ({LANG_NAMES[lang]}) from {t_info['SOURCE']}")
+            return
         Utils.save_to_disk(f'lang/{lang}', content)
-        LANGS[lang] = content
+        # swap in one go, languages nobody used yet stay on disk until they are needed
+        if lang in LANGS:
+            LANGS[lang] = content
+            TEMPLATES.pop(lang, None)
+        versions[lang] = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        if save:
+            Configuration.set_persistent_var("lang_versions", versions)
         GearbotLogging.info(f"Updated {lang} ({LANG_NAMES[lang]})!")
 
 
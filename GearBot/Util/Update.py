@@ -2,6 +2,7 @@ import importlib
 
 from Bot import Reloader, TheRealGearBot
 from Util import GearbotLogging, Emoji, Utils, Translator, Configuration
+from database import DBUtils
 
 
 async def upgrade(name, bot):
@@ -22,10 +23,16 @@ async def update(name, bot):
     if antiraid is not None:
         trackers = antiraid.raid_trackers
     untranslatable = Translator.untranlatable
+    configs = Configuration.SERVER_CONFIGS
+    # reloading resets the message write buffer and pending config saves, get them out first
+    await DBUtils.flush()
+    await Configuration.flush()
     importlib.reload(Reloader)
     for c in Reloader.components:
         importlib.reload(c)
     Translator.untranlatable = untranslatable
+    # keep handing out the configs we had instead of template defaults until they are prepared again
+    Configuration.SERVER_CONFIGS = configs
     GearbotLogging.info("Reloading all cogs...")
     temp = []
     for cog in bot.cogs:
@@ -44,6 +51,7 @@ async def update(name, bot):
         antiraid.raid_trackers = trackers
 
     await TheRealGearBot.initialize(bot)
+    await Configuration.restore(configs, [g.id for g in bot.guilds])
     c = await Utils.get_commit()
     GearbotLogging.info(f"Hot reload complete, now running on {c}")
     bot.version = c
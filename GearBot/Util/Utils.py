@@ -2,6 +2,7 @@ import asyncio
 import json
 import os
 import subprocess
+import tempfile
 from collections import namedtuple, OrderedDict
 from datetime import datetime
 from json import JSONDecodeError
@@ -11,8 +12,9 @@ import discord
 import math
 from discord import NotFound, DiscordException
 
-from Util import GearbotLogging, Translator, Emoji
+from Util import GearbotLogging, Translator, Emoji, Configuration
 from Util.Matchers import ROLE_ID_MATCHER, CHANNEL_ID_MATCHER, ID_MATCHER, EMOJI_MATCHER, URL_MATCHER
+from database import DBUtils
 
 BOT = None
 
@@ -35,12 +37,35 @@ def fetch_from_disk(filename, alternative=None):
     return dict()
 
 def save_to_disk(filename, dict):
-    with open(f"{filename}.json", "w", encoding="UTF-8") as file:
-        json.dump(dict, file, indent=4, skipkeys=True, sort_keys=True)
+    write_file(f"{filename}.json", json.dumps(dict, indent=4, skipkeys=True, sort_keys=True))
+
+
+async def save_to_disk_async(filename, dict):
+    # serialize here, the event loop might still be changing the dict while the executor is busy
+    data = json.dumps(dict, indent=4, skipkeys=True, sort_keys=True)
+    await asyncio.get_event_loop().run_in_executor(None, write_file, f"{filename}.json", data)
+
+
+def write_file(filename, data):
+    # write to a temp file and swap it in, a crash halfway through can't leave a corrupt file behind that way
+    # every write gets its own temp file so writes of the same file from different threads can't mix
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", prefix=f"{os.path.basename(filename)}.", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="UTF-8") as file:
+            file.write(data)
+        # mkstemp makes it private, configs are normally readable
+        os.chmod(temp, 0o644)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
 
 
 async def cleanExit(bot, trigger):
     await GearbotLogging.bot_log(f"Shutdown triggered by {trigger}.")
+    # make sure all logged messages still waiting in the write buffer make it to the database
+    await DBUtils.flush()
+    await Configuration.flush()
     await bot.logout()
     await bot.close()
     bot.aiosession.close()
@@ -137,10 +162,20 @@ def clean_name(text):
 
 known_invalid_users = []
 user_cache = OrderedDict()
+UserClass = namedtuple("UserClass", "name id discriminator bot avatar_url created_at is_avatar_animated mention")
+FETCH_CONCURRENCY = 10
 
 
 async def username(uid, fetch=True, clean=True):
-    user = await get_user(uid, fetch)
+    return format_username(await get_user(uid, fetch), clean)
+
+
+async def usernames(uids, fetch=True, clean=True):
+    users = await get_users(uids, fetch)
+    return {uid: format_username(user, clean) for uid, user in users.items()}
+
+
+def format_username(user, clean=True):
     if user is None:
         return "UNKNOWN USER"
     if clean:
@@ -150,7 +185,6 @@ async def username(uid, fetch=True, clean=True):
 
 
 async def get_user(uid, fetch=True):
-    UserClass = namedtuple("UserClass", "name id discriminator bot avatar_url created_at is_avatar_animated mention")
     user = BOT.get_user(uid)
     if user is None:
         if uid in known_invalid_users:
@@ -160,52 +194,96 @@ async def get_user(uid, fetch=True):
             userCacheInfo = await BOT.redis_pool.hgetall(f"users:{uid}")
 
             if len(userCacheInfo) == 8: # It existed in the Redis cache, check length cause sometimes somehow things are missing, somehow
-                userFormed = UserClass(
-                    userCacheInfo["name"],
-                    userCacheInfo["id"],
-                    userCacheInfo["discriminator"],
-                    userCacheInfo["bot"] == "1",
-                    userCacheInfo["avatar_url"],
-                    datetime.fromtimestamp(float(userCacheInfo["created_at"])),
-                    bool(userCacheInfo["is_avatar_animated"]) == "1",
-                    userCacheInfo["mention"]
-                )
-
-                return userFormed
-            if fetch:
-                try:
-                    user = await BOT.fetch_user(uid)
-                    pipeline = BOT.redis_pool.pipeline()
-                    pipeline.hmset_dict(f"users:{uid}",
-                        name = user.name,
-                        id = user.id,
-                        discriminator = user.discriminator,
-                        bot = int(user.bot),
-                        avatar_url = str(user.avatar_url),
-                        created_at = user.created_at.timestamp(),
-                        is_avatar_animated = int(user.is_avatar_animated()),
-                        mention = user.mention
-                    )
-
-                    pipeline.expire(f"users:{uid}", 3000) # 5 minute cache life
-
-                    BOT.loop.create_task(pipeline.execute())
-
-                except NotFound:
-                    known_invalid_users.append(uid)
-                    return None
+                return user_from_cache(userCacheInfo)
         else: # No Redis, using the dict method instead
             if uid in user_cache:
                 return user_cache[uid]
-            if fetch:
-                try:
-                    user = await BOT.fetch_user(uid)
-                    if len(user_cache) >= 10: # Limit the cache size to the most recent 10
-                        user_cache.popitem()
-                    user_cache[uid] = user
-                except NotFound:
-                    known_invalid_users.append(uid)
-                    return None
+        if fetch:
+            user = await fetch_user(uid)
+    return user
+
+
+async def get_users(uids, fetch=True):
+    """
+    bulk version of get_user, checks the client cache first, then does all redis lookups in a single pipeline
+    and finally fetches whatever is left with a limited amount of concurrent requests
+    """
+    users = dict()
+    todo = []
+    for uid in set(uids):
+        user = BOT.get_user(uid)
+        if user is not None or uid in known_invalid_users:
+            users[uid] = user
+        elif BOT.redis_pool is None and uid in user_cache:
+            users[uid] = user_cache[uid]
+        else:
+            todo.append(uid)
+
+    if len(todo) > 0 and BOT.redis_pool is not None:
+        pipeline = BOT.redis_pool.pipeline()
+        for uid in todo:
+            pipeline.hgetall(f"users:{uid}")
+        missing = []
+        for uid, info in zip(todo, await pipeline.execute()):
+            if len(info) == 8:
+                users[uid] = user_from_cache(info)
+            else:
+                missing.append(uid)
+        todo = missing
+
+    if fetch and len(todo) > 0:
+        limiter = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def fetcher(uid):
+            async with limiter:
+                users[uid] = await fetch_user(uid)
+
+        await asyncio.gather(*[fetcher(uid) for uid in todo])
+    else:
+        for uid in todo:
+            users[uid] = None
+    return users
+
+
+def user_from_cache(userCacheInfo):
+    return UserClass(
+        userCacheInfo["name"],
+        userCacheInfo["id"],
+        userCacheInfo["discriminator"],
+        userCacheInfo["bot"] == "1",
+        userCacheInfo["avatar_url"],
+        datetime.fromtimestamp(float(userCacheInfo["created_at"])),
+        bool(userCacheInfo["is_avatar_animated"]) == "1",
+        userCacheInfo["mention"]
+    )
+
+
+async def fetch_user(uid):
+    try:
+        user = await BOT.fetch_user(uid)
+    except NotFound:
+        known_invalid_users.append(uid)
+        return None
+    if BOT.redis_pool is not None:
+        pipeline = BOT.redis_pool.pipeline()
+        pipeline.hmset_dict(f"users:{uid}",
+            name = user.name,
+            id = user.id,
+            discriminator = user.discriminator,
+            bot = int(user.bot),
+            avatar_url = str(user.avatar_url),
+            created_at = user.created_at.timestamp(),
+            is_avatar_animated = int(user.is_avatar_animated()),
+            mention = user.mention
+        )
+
+        pipeline.expire(f"users:{uid}", 3000) # 5 minute cache life
+
+        BOT.loop.create_task(pipeline.execute())
+    else:
+        if len(user_cache) >= 10: # Limit the cache size to the most recent 10
+            user_cache.popitem()
+        user_cache[uid] = user
     return user
 
 
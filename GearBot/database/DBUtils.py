@@ -1,4 +1,6 @@
+import asyncio
 import time
+from itertools import islice
 
 from discord import MessageType
 from tortoise.exceptions import IntegrityError
@@ -6,24 +8,230 @@ from tortoise.exceptions import IntegrityError
 from Util import GearbotLogging
 from database.DatabaseConnector import LoggedMessage, LoggedAttachment
 
+# write-behind buffer for logged messages by message id, flushed as multi-row inserts
+# reads check it (and the batch being written) before going to the database
+PENDING = dict()
+# batch currently being written, and edits that came in for it and need to be applied after the insert
+IN_FLIGHT = dict()
+IN_FLIGHT_EDITS = dict()
+FLUSH_INTERVAL = 0.5
+FLUSH_ROWS = 500
+MAX_PENDING = 5000
+RETRY_DELAY = 5
+# how long to keep retrying while the database is unavailable before giving up on the oldest messages
+MAX_RETRY_TIME = 60
+flusher = None
+flush_task = None
+flush_lock = None
+# set whenever the buffer drops below MAX_PENDING again
+room = None
+# when writes started failing and when to try again, both None while the database is fine
+failing_since = None
+retry_at = None
+dropped = 0
+
+
+def message_fields(message):
+    message_type = message.type
+
+    if message_type == MessageType.default:
+        message_type = None
+    else:
+        if not isinstance(message_type, int):
+            message_type = message_type.value
+    return dict(messageid=message.id, content=message.content, author=message.author.id,
+                channel=message.channel.id, server=message.guild.id, type=message_type, pinned=message.pinned)
+
+
+def attachment_fields(message):
+    return [dict(id=a.id, name=a.filename, isImage=(a.width is not None or a.width is 0), message_id=message.id)
+            for a in message.attachments]
+
 
 async def insert_message(message):
+    """
+    inserts right away, for when the caller needs the logged message back
+    """
     try:
-        message_type = message.type
-
-        if message_type == MessageType.default:
-            message_type = None
-        else:
-            if not isinstance(message_type, int):
-                message_type = message_type.value
-        logged = await LoggedMessage.create(messageid=message.id, content=message.content,
-                                   author=message.author.id,
-                                   channel=message.channel.id, server=message.guild.id,
-                                   type=message_type, pinned=message.pinned)
-        for a in message.attachments:
-            await LoggedAttachment.create(id=a.id, name=a.filename,
-                                       isImage=(a.width is not None or a.width is 0),
-                                       message=logged)
+        logged = await LoggedMessage.create(**message_fields(message))
+        for a in attachment_fields(message):
+            await LoggedAttachment.create(**a)
     except IntegrityError:
         return message
-    return logged
\ No newline at end of file
+    return logged
+
+
+async def queue_message(message):
+    PENDING[message.id] = (message_fields(message), attachment_fields(message))
+    if len(PENDING) >= MAX_PENDING:
+        await make_room()
+    elif retry_at is not None or flushing():
+        # the running flush or the scheduled retry picks these up
+        return
+    elif len(PENDING) >= FLUSH_ROWS:
+        start_flush()
+    else:
+        schedule_flush(FLUSH_INTERVAL)
+
+
+def flushing():
+    return (flush_task is not None and not flush_task.done()) or (flush_lock is not None and flush_lock.locked())
+
+
+def start_flush():
+    global flush_task
+    if not flushing():
+        flush_task = asyncio.ensure_future(flush())
+
+
+def schedule_flush(delay):
+    global flusher
+    if flusher is None:
+        flusher = asyncio.ensure_future(delayed_flush(delay))
+
+
+async def make_room():
+    global room, dropped
+    if failing_since is not None and time.time() - failing_since >= MAX_RETRY_TIME:
+        # database has been gone for too long, drop the oldest instead of holding everything up
+        for message_id in list(islice(PENDING, len(PENDING) - MAX_PENDING + 1)):
+            del PENDING[message_id]
+            dropped += 1
+        return
+    # database can't keep up, make the caller wait for the buffer to drain instead of growing forever
+    if retry_at is None:
+        start_flush()
+    if room is None:
+        room = asyncio.Event()
+    room.clear()
+    await room.wait()
+
+
+def check_room():
+    if room is not None and len(PENDING) < MAX_PENDING:
+        room.set()
+
+
+def get_pending(message_id):
+    """
+    (fields, attachments) of a logged message that didn't make it to the database yet, None if it's not waiting
+    """
+    pending = PENDING.get(message_id)
+    return pending if pending is not None else IN_FLIGHT.get(message_id)
+
+
+def update_pending(message_id, content, pinned):
+    # edits can arrive before the original made it to the database, patch it in the buffer so we don't write stale content
+    # if it's being written right now the row might not exist yet, so remember the edit to apply after the insert
+    pending = get_pending(message_id)
+    if pending is not None:
+        pending[0]["content"] = content
+        pending[0]["pinned"] = pinned
+    if message_id in IN_FLIGHT:
+        IN_FLIGHT_EDITS[message_id] = (content, pinned)
+
+
+async def delayed_flush(delay):
+    global flusher
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        flusher = None
+    if retry_at is not None and time.time() < retry_at:
+        # a retry got scheduled while we were waiting, don't try again before it's due
+        schedule_flush(retry_at - time.time())
+        return
+    await flush()
+
+
+async def flush():
+    global flush_lock, failing_since, retry_at
+    if flush_lock is None:
+        flush_lock = asyncio.Lock()
+    async with flush_lock:
+        while len(PENDING) > 0:
+            batch = [PENDING.pop(message_id) for message_id in list(islice(PENDING, FLUSH_ROWS))]
+            IN_FLIGHT.update((m["messageid"], (m, attachments)) for m, attachments in batch)
+            try:
+                await write_batch(batch)
+            except Exception as ex:
+                GearbotLogging.exception(f"Failed to write a batch of {len(batch)} logged messages", ex)
+                now = time.time()
+                if failing_since is None:
+                    failing_since = now
+                requeue(batch, now - failing_since >= MAX_RETRY_TIME)
+                report_dropped()
+                check_room()
+                # give the database some time before trying again, everything that comes in until then just gets buffered
+                retry_at = now + RETRY_DELAY
+                schedule_flush(RETRY_DELAY)
+                return
+            else:
+                if failing_since is not None:
+                    report_dropped()
+                    GearbotLogging.info(f"Logged messages are being written again after {round(time.time() - failing_since)}s")
+                failing_since = None
+                retry_at = None
+                await apply_edits(batch)
+            finally:
+                for m, _ in batch:
+                    IN_FLIGHT.pop(m["messageid"], None)
+                    IN_FLIGHT_EDITS.pop(m["messageid"], None)
+            check_room()
+
+
+def report_dropped():
+    global dropped
+    if dropped > 0:
+        GearbotLogging.error(f"Dropped {dropped} logged messages, the database has been unavailable for {round(time.time() - failing_since)}s")
+        dropped = 0
+
+
+def requeue(batch, expired):
+    global PENDING, dropped
+    if expired:
+        dropped += len(batch)
+        return
+    # anything that got queued again in the meantime is newer
+    retry = {m["messageid"]: (m, attachments) for m, attachments in batch if m["messageid"] not in PENDING}
+    # back in front so they stay in order
+    PENDING = {**retry, **PENDING}
+
+
+async def apply_edits(batch):
+    # rows exist now, these edits came in while they were being written
+    for m, _ in batch:
+        edit = IN_FLIGHT_EDITS.pop(m["messageid"], None)
+        if edit is not None:
+            try:
+                await LoggedMessage.filter(messageid=m["messageid"]).update(content=edit[0], pinned=edit[1])
+            except Exception as ex:
+                GearbotLogging.exception(f"Failed to apply an edit to logged message {m['messageid']}", ex)
+
+
+async def write_batch(batch):
+    start = time.perf_counter()
+    try:
+        await LoggedMessage.bulk_create([LoggedMessage(**m) for m, _ in batch])
+    except IntegrityError:
+        # some of these were already logged, insert one by one so the rest still make it in
+        written = []
+        for m, attachments in batch:
+            try:
+                await LoggedMessage.create(**m)
+            except IntegrityError:
+                pass
+            else:
+                written.append((m, attachments))
+        batch = written
+    attachments = [LoggedAttachment(**a) for _, message_attachments in batch for a in message_attachments]
+    if len(attachments) > 0:
+        try:
+            await LoggedAttachment.bulk_create(attachments)
+        except IntegrityError:
+            for a in attachments:
+                try:
+                    await a.save()
+                except IntegrityError:
+                    pass
+    GearbotLogging.debug(f"Wrote {len(batch)} logged messages in {round((time.perf_counter() - start) * 1000)}ms")
@@ -41,6 +41,9 @@ class Infraction(Model):
     end = fields.BigIntField(null=True)
     active = fields.BooleanField(default=True)
 
+    class Meta:
+        indexes = (("type", "active", "end"), ("guild_id", "id"), ("guild_id", "user_id"), ("guild_id", "mod_id"))
+
 
 class Reminder(Model):
     id = fields.IntField(pk=True, generated=True)
@@ -54,6 +57,9 @@ class Reminder(Model):
     time = fields.BigIntField()
     status = fields.IntField()
 
+    class Meta:
+        indexes = (("status", "time"),)
+
 
 
 class Raid(Model):
@@ -77,6 +83,11 @@ class RaidAction(Model):
     infraction = fields.ForeignKeyField("models.Infraction", related_name="RaiderAction", source_field="infraction_id", null=True)
 
 
+class GuildConfig(Model):
+    guild_id = fields.BigIntField(pk=True, generated=False)
+    config = fields.TextField()
+
+
 async def init():
     await Tortoise.init(
         db_url=f"mysql://{Configuration.get_master_var('DATABASE_USER')}:{Configuration.get_master_var('DATABASE_PASS')}@{Configuration.get_master_var('DATABASE_HOST')}:{Configuration.get_master_var('DATABASE_PORT')}/{Configuration.get_master_var('DATABASE_NAME')}",
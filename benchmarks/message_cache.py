@@ -0,0 +1,83 @@
+"""
+Benchmark for the recent message cache format in MessageUtils: the packed single string (encode_message/decode_message)
+against the hash with stringified fields it replaced (decode_legacy_message). Needs no redis, it measures the size of
+what gets stored and the time to encode and decode it on a generated mix of messages.
+Run from the repository root:
+
+python3 benchmarks/message_cache.py [--messages 20000] [--seed 0]
+"""
+import os
+import random
+import string
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GearBot"))
+
+from Util import MessageUtils
+
+
+def snowflake(rng):
+    return rng.randint(100000000000000000, 900000000000000000)
+
+
+def generate(rng, count):
+    alphabet = string.ascii_letters + string.digits + "      .,!?éüß😀"
+    messages = []
+    for _ in range(count):
+        # mostly short chat messages with the odd long one, 1 in 5 has attachments
+        length = min(int(rng.expovariate(1 / 60)), 2000)
+        content = "".join(rng.choice(alphabet) for _ in range(length))
+        attachments = [(snowflake(rng), f"image_{rng.randint(0, 9999)}.png") for _ in range(rng.choice([1, 1, 2]))] if rng.random() < 0.2 else []
+        message_type = None if rng.random() < 0.95 else 19
+        messages.append((snowflake(rng), snowflake(rng), snowflake(rng), snowflake(rng), message_type, rng.random() < 0.01, attachments, content))
+    return messages
+
+
+def legacy_encode(author, channel, server, message_type, pinned, attachments, content):
+    # the fields insert_message used to hmset, encoded to bytes the way aioredis sends them
+    fields = dict(author=author, content=content, channel=channel, server=server, pinned=1 if pinned else 0,
+                  attachments='|'.join(f"{aid}/{name}" for aid, name in attachments))
+    if message_type is not None:
+        fields["type"] = message_type
+    return {key.encode(): str(value).encode() for key, value in fields.items()}
+
+
+def legacy_decode(message_id, data):
+    # hgetall hands back decoded strings
+    return MessageUtils.decode_legacy_message(message_id, {key.decode(): value.decode() for key, value in data.items()})
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    out = [function(*item) for item in items]
+    return time.perf_counter() - start, out
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000, help="How many messages to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated messages")
+    clargs = parser.parse_args()
+
+    messages = generate(random.Random(clargs.seed), clargs.messages)
+    fields = [m[1:] for m in messages]
+
+    legacy_encode_time, legacy = timed(legacy_encode, fields)
+    packed_encode_time, packed = timed(MessageUtils.encode_message, fields)
+    legacy_decode_time, legacy_decoded = timed(legacy_decode, [(m[0], data) for m, data in zip(messages, legacy)])
+    packed_decode_time, packed_decoded = timed(MessageUtils.decode_message, [(m[0], data) for m, data in zip(messages, packed)])
+    assert [m.content for m in legacy_decoded] == [m.content for m in packed_decoded]
+
+    # field names count for the hash, redis stores them with every entry
+    legacy_size = sum(len(key) + len(value) for data in legacy for key, value in data.items()) / len(messages)
+    legacy_entries = sum(len(data) for data in legacy) / len(messages)
+    packed_size = sum(len(data) for data in packed) / len(messages)
+
+    print(f"{len(messages)} messages, average content {sum(len(m[-1]) for m in messages) / len(messages):.1f} characters")
+    print(f"{'':<8} {'bytes/message':>14} {'hash entries':>13} {'encode us':>10} {'decode us':>10}")
+    for name, size, entries, encode, decode in [("hash", legacy_size, legacy_entries, legacy_encode_time, legacy_decode_time),
+                                                ("packed", packed_size, 1, packed_encode_time, packed_decode_time)]:
+        print(f"{name:<8} {size:14.1f} {entries:13.1f} {encode / len(messages) * 1000000:10.2f} {decode / len(messages) * 1000000:10.2f}")
+    print("sizes are the stored payload only, redis adds its own overhead per key and per hash entry on top")
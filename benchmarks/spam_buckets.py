@@ -0,0 +1,122 @@
+"""
+Benchmark for the anti-spam buckets: the scripted single round trip check (RedisEngine.run_many, what AntiSpam uses)
+against the separate redis commands SpamBucket used before it (expire, one zadd per unit, expire, count, and
+count/size/get on top when a bucket triggers). Needs a redis to talk to, use an empty or throwaway database,
+bucket keys are prefixed with bench: and cleaned up afterwards. Run from the repository root:
+
+python3 benchmarks/spam_buckets.py [--redis localhost:6379] [--messages 2000] [--rtt 0]
+
+--rtt adds an artificial delay in milliseconds to every round trip, to see what a redis on another machine would do
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+
+import aioredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GearBot"))
+
+from Util import SpamBucket
+
+# bucket type, units one message adds to it (like a message with 3 mentions and 2 newlines)
+BUCKETS = [("messages", 1), ("mentions", 3), ("newlines", 2), ("duplicates", 1)]
+LIMIT = 10
+PERIOD = 5
+USERS = 20
+# simulated time between messages of the same user, fast enough to trigger the buckets now and then
+INTERVAL = 400
+
+
+class CountingRedis:
+    """
+    counts the round trips that go through it, a pipeline counts as one once executed
+    """
+
+    def __init__(self, redis, rtt):
+        self.redis = redis
+        self.rtt = rtt
+        self.trips = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.redis, name)
+        if not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            self.trips += 1
+            if self.rtt > 0:
+                await asyncio.sleep(self.rtt)
+            return await attribute(*args, **kwargs)
+        return call
+
+
+async def legacy_check(redis, key, now, amount, member):
+    # what SpamBucket.check followed by the count/size/get in AntiSpam used to do, one await per command
+    await redis.zremrangebyscore(key, max=now - PERIOD * 1000)
+    await redis.zremrangebyscore(key, max=now - PERIOD * 1000)
+    for i in range(amount):
+        await redis.zadd(key, now, f"{member}-{i}")
+    await redis.expire(key, PERIOD)
+    count = await redis.zcount(key)
+    if count >= LIMIT:
+        await redis.zcount(key)
+        values = await redis.zrangebyscore(key)
+        if len(values) > 1:
+            (await redis.zscore(key, values[-1])) - (await redis.zscore(key, values[0]))
+        await redis.zrangebyscore(key)
+    return count
+
+
+async def legacy_message(redis, user, now, member):
+    for name, amount in BUCKETS:
+        await legacy_check(redis, f"bench:legacy:{name}:{user}", now, amount, member)
+
+
+async def scripted_message(engine, user, now, member):
+    await engine.run_many([SpamBucket.BucketOp(f"bench:scripted:{name}:{user}", now, PERIOD, amount, member)
+                           for name, amount in BUCKETS])
+
+
+async def measure(name, handler, counter, messages):
+    latencies = []
+    counter.trips = 0
+    start = SpamBucket.ms_time()
+    for i in range(messages):
+        user = i % USERS
+        now = start + (i // USERS) * INTERVAL
+        before = time.perf_counter()
+        await handler(user, now, f"1-{i}")
+        latencies.append((time.perf_counter() - before) * 1000)
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<10} {counter.trips / messages:12.1f} {statistics.median(latencies):10.3f} {p99:10.3f}")
+
+
+async def main(clargs):
+    host, port = clargs.redis.split(":")
+    redis = await aioredis.create_redis_pool((host, int(port)), encoding="utf-8")
+    counter = CountingRedis(redis, clargs.rtt / 1000)
+    await SpamBucket.initialize(redis)
+    engine = SpamBucket.RedisEngine(counter)
+    print(f"{clargs.messages} messages over {USERS} users, {len(BUCKETS)} buckets per message, {clargs.rtt}ms added per round trip")
+    print(f"{'':<10} {'trips/message':>12} {'p50 ms':>10} {'p99 ms':>10}")
+    try:
+        await measure("separate", lambda user, now, member: legacy_message(counter, user, now, member), counter, clargs.messages)
+        await measure("scripted", lambda user, now, member: scripted_message(engine, user, now, member), counter, clargs.messages)
+    finally:
+        keys = await redis.keys("bench:*")
+        if len(keys) > 0:
+            await redis.delete(*keys)
+        redis.close()
+        await redis.wait_closed()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--redis", default="localhost:6379", help="host:port of the redis to use")
+    parser.add_argument("--messages", type=int, default=2000, help="How many messages to check")
+    parser.add_argument("--rtt", type=float, default=0, help="Extra milliseconds of latency per round trip")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""
+Microbenchmark for the parsed template cache in Translator: formats every en_US string the old way (pyseeyou.format,
+parsing the string on every call) and through Translator.format (parsed once, cached per language and key).
+Run from the repository root, it needs lang/en_US.json:
+
+python3 benchmarks/translations.py [--rounds 5]
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GearBot"))
+
+import pyseeyou
+
+from Util import Translator
+
+
+class Arguments(dict):
+    # every placeholder gets a number, that works for plain values and plurals, selects fall back to their other branch
+    def __missing__(self, key):
+        return 2
+
+
+def run(formatter, strings, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key, string in strings.items():
+            formatter(key, string)
+    return time.perf_counter() - start
+
+
+def report(name, duration, calls, baseline=None):
+    line = f"{name:<22} {duration:8.3f}s {duration / calls * 1000000:10.1f}us/call"
+    if baseline is not None:
+        line += f" {baseline / duration:8.1f}x"
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5, help="How many times to format every string")
+    clargs = parser.parse_args()
+
+    Translator.load_translations("en_US")
+    strings = dict()
+    for key, string in Translator.LANGS["en_US"].items():
+        try:
+            pyseeyou.format(string, Arguments(), "en_US")
+        except Exception:
+            continue  # needs real arguments to format, same for both so just leave it out
+        strings[key] = string
+    calls = len(strings) * clargs.rounds
+    print(f"Formatting {len(strings)} en_US strings {clargs.rounds} times ({calls} calls)")
+
+    uncached = run(lambda key, string: pyseeyou.format(string, Arguments(), "en_US"), strings, clargs.rounds)
+    Translator.TEMPLATES.clear()
+    cold = run(lambda key, string: Translator.format("en_US", key, Arguments()), strings, 1)
+    cached = run(lambda key, string: Translator.format("en_US", key, Arguments()), strings, clargs.rounds)
+
+    report("parse every call", uncached, calls)
+    report("cache, first use", cold, len(strings), uncached / clargs.rounds)
+    report("cache, warm", cached, calls, uncached)
@@ -34,11 +34,20 @@ create table loggedattachment
 
 create table infraction
 (
-    id       int unsigned primary key not null,
-    guild_id bigint                   not null,
-    user_id  bigint                   not null,
-    mod_id   bigint                   not null,
-    type     varchar(10)              not null
+    id       int unsigned auto_increment primary key,
+    guild_id bigint                                   not null,
+    user_id  bigint                                   not null,
+    mod_id   bigint                                   not null,
+    type     varchar(10) collate utf8mb4_general_ci   not null,
+    reason   varchar(2000) collate utf8mb4_general_ci not null,
+    start    bigint                                   not null,
+    end      bigint                                   null,
+    active   bool                                     not null default true,
+    index (type, active, end),
+    index (guild_id, id),
+    index (guild_id, user_id),
+    index (guild_id, mod_id),
+    fulltext (reason)
 );
 
 
@@ -54,7 +63,8 @@ create table reminder
     send       int unsigned             not null,
     time       int unsigned             not null,
     status     enum ('1', '2', '3'),
-    index (user_id)
+    index (user_id),
+    index (status, time)
 );
 
 create table userinfo
@@ -72,5 +82,10 @@ create table dashsession
     user_id    bigint                  not null references userinfo (id),
     expires_at datetime                not null,
     index (user_id)
-)
+);
 
+create table guildconfig
+(
+    guild_id bigint primary key not null,
+    config   mediumtext         not null
+)
@@ -0,0 +1,6 @@
+-- index the timed infraction expiry sweep relies on, for databases created before it was added to database.sql
+-- without it every sweep scans the whole infraction table
+-- run once: mysql -u <user> -p <database> < migration/infraction_expiry_index.sql
+
+alter table infraction
+    add index (type, active, end);
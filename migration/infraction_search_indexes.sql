@@ -0,0 +1,12 @@
+-- indexes infraction searches rely on, for databases created before they were added to database.sql
+-- without the fulltext index reason searches fail with "Can't find FULLTEXT index matching the column list"
+-- run once: mysql -u <user> -p <database> < migration/infraction_search_indexes.sql
+
+alter table infraction
+    add index (guild_id, id),
+    add index (guild_id, user_id),
+    add index (guild_id, mod_id);
+
+-- innodb builds the first fulltext index of a table with a full rebuild, this can take a while on big tables
+alter table infraction
+    add fulltext (reason);
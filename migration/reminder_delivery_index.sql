@@ -0,0 +1,6 @@
+-- index the reminder delivery sweep relies on, for databases created before it was added to database.sql
+-- without it every sweep scans the whole reminder table
+-- run once: mysql -u <user> -p <database> < migration/reminder_delivery_index.sql
+
+alter table reminder
+    add index (status, time);